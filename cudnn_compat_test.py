@@ -0,0 +1,110 @@
+"""Checks that the cuDNN paths of `LSTMCell` compute what the cell computes.
+
+Covers `fused_dynamic_rnn` and `LSTMCell.load_cudnn_checkpoint`.  `ln_cell`
+and `h_cell` each carry a copy of both, so every test runs against both
+modules.  `cudnn_lstm` only has a GPU kernel, the tests running it are
+skipped without a GPU.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.contrib.cudnn_rnn.python.ops import cudnn_rnn_ops
+
+import h_cell
+import ln_cell
+
+_MODULES = (ln_cell, h_cell)
+
+
+class FusedDynamicRnnTest(tf.test.TestCase):
+
+  def setUp(self):
+    if not tf.test.is_gpu_available(cuda_only=True):
+      self.skipTest("cudnn_lstm needs a GPU")
+
+  def _check_matches_dynamic_rnn(self, module, time_major):
+    batch_size, max_time, input_size, num_units = 3, 5, 4, 8
+    shape = ([max_time, batch_size, input_size] if time_major else
+             [batch_size, max_time, input_size])
+    x = np.random.randn(*shape).astype(np.float32)
+    with tf.Graph().as_default() as graph, self.test_session(
+        graph=graph, use_gpu=True) as sess:
+      inputs = tf.constant(x)
+      cell = module.LSTMCell(num_units)
+      fused_outputs, fused_state = module.fused_dynamic_rnn(
+          cell, inputs, dtype=tf.float32, time_major=time_major)
+      # The second run reuses the variables the fused path built.
+      outputs, state = tf.nn.dynamic_rnn(
+          cell, inputs, dtype=tf.float32, time_major=time_major)
+      self.assertTrue(cell.built)
+      self.assertEqual(3, len(cell.trainable_weights))
+      sess.run(tf.global_variables_initializer())
+      results = sess.run([fused_outputs, fused_state, outputs, state])
+      self.assertAllClose(results[0], results[2], atol=1e-5)
+      self.assertAllClose(results[1], results[3], atol=1e-5)
+
+  def testMatchesDynamicRnn(self):
+    for module in _MODULES:
+      self._check_matches_dynamic_rnn(module, time_major=False)
+
+  def testMatchesDynamicRnnTimeMajor(self):
+    for module in _MODULES:
+      self._check_matches_dynamic_rnn(module, time_major=True)
+
+  def testSecondCallReusesVariables(self):
+    for module in _MODULES:
+      with tf.Graph().as_default():
+        inputs = tf.zeros([2, 3, 4])
+        cell = module.LSTMCell(8)
+        module.fused_dynamic_rnn(cell, inputs, dtype=tf.float32)
+        module.fused_dynamic_rnn(cell, inputs, dtype=tf.float32)
+        self.assertEqual(3, len(tf.trainable_variables()))
+
+
+class LoadCudnnCheckpointTest(tf.test.TestCase):
+
+  def testMatchesCudnnLstm(self):
+    if not tf.test.is_gpu_available(cuda_only=True):
+      self.skipTest("cudnn_lstm needs a GPU")
+    batch_size, max_time, input_size, num_units = 3, 5, 4, 8
+    x = np.random.randn(max_time, batch_size, input_size).astype(np.float32)
+    random = lambda *shape: tf.constant(
+        np.random.randn(*shape).astype(np.float32))
+    for module in _MODULES:
+      with tf.Graph().as_default() as graph, self.test_session(
+          graph=graph, use_gpu=True) as sess:
+        # Canonical params in cuDNN's own [i, f, c, o] gate order: four input
+        # matrices, four recurrent matrices, then the eight bias vectors.
+        weights = ([random(num_units, input_size) for _ in range(4)] +
+                   [random(num_units, num_units) for _ in range(4)])
+        biases = [random(num_units) for _ in range(8)]
+        params = cudnn_rnn_ops.cudnn_rnn_canonical_to_opaque_params(
+            "lstm", 1, num_units, input_size, weights, biases)
+        inputs = tf.constant(x)
+        zeros = tf.zeros([1, batch_size, num_units])
+        cudnn_outputs, cudnn_h, cudnn_c = cudnn_rnn_ops.cudnn_lstm(
+            inputs, zeros, zeros, params, is_training=False)
+
+        cell = module.LSTMCell(num_units)
+        outputs, state = tf.nn.dynamic_rnn(
+            cell, inputs, dtype=tf.float32, time_major=True)
+        sess.run(tf.global_variables_initializer())
+        sess.run(cell.load_cudnn_checkpoint(params))
+        results = sess.run([cudnn_outputs, cudnn_h[0], cudnn_c[0],
+                            outputs, state.h, state.c])
+        self.assertAllClose(results[0], results[3], atol=1e-5)
+        self.assertAllClose(results[1], results[4], atol=1e-5)
+        self.assertAllClose(results[2], results[5], atol=1e-5)
+
+  def testRequiresBuiltCell(self):
+    for module in _MODULES:
+      with tf.Graph().as_default():
+        with self.assertRaisesRegexp(ValueError, "must be built"):
+          module.LSTMCell(8).load_cudnn_checkpoint(tf.zeros([1]))
+
+
+if __name__ == "__main__":
+  tf.test.main()
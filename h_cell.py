@@ -27,7 +27,10 @@ from __future__ import print_function
 import collections
 import hashlib
 import numbers
+import weakref
 
+from tensorflow.contrib.compiler import jit
+from tensorflow.contrib.cudnn_rnn.python.ops import cudnn_rnn_ops
 from tensorflow.python.eager import context
 from tensorflow.python.framework import constant_op
 from tensorflow.python.framework import dtypes
@@ -37,11 +40,13 @@ from tensorflow.python.framework import tensor_util
 from tensorflow.python.layers import base as base_layer
 from tensorflow.python.ops import array_ops
 from tensorflow.python.ops import clip_ops
+from tensorflow.python.ops import control_flow_ops
 from tensorflow.python.ops import init_ops
 from tensorflow.python.ops import math_ops
 from tensorflow.python.ops import nn_ops
 from tensorflow.python.ops import partitioned_variables
 from tensorflow.python.ops import random_ops
+from tensorflow.python.ops import state_ops
 from tensorflow.python.ops import tensor_array_ops
 from tensorflow.python.ops import variable_scope as vs
 from tensorflow.python.ops import variables as tf_variables
@@ -51,6 +56,9 @@ import tensorflow as tf
 
 _BIAS_VARIABLE_NAME = "bias"
 _WEIGHTS_VARIABLE_NAME = "kernel"
+_RECURRENT_BIAS_VARIABLE_NAME = "recurrent_bias"
+# Gradient registry keys are global, ln_cell carries its own copy of this code.
+_NN_MATMUL_GRAD = "NNMatMulGrad_" + __name__
 
 
 def _like_rnncell(cell):
@@ -82,6 +90,12 @@ def _concat(prefix, suffix, static=False):
     ValueError: if prefix or suffix was `None` and asked for dynamic
       Tensors out.
   """
+  # Common case from zero_state: an int batch size and an int state size.
+  if (isinstance(prefix, numbers.Integral) and
+      isinstance(suffix, numbers.Integral)):
+    if static:
+      return [prefix, suffix]
+    return constant_op.constant([prefix, suffix], dtype=dtypes.int32)
   if isinstance(prefix, ops.Tensor):
     p = prefix
     p_static = tensor_util.constant_value(prefix)
@@ -133,6 +147,94 @@ def _zero_state_tensors(state_size, batch_size, dtype):
   return nest.map_structure(get_state_shape, state_size)
 
 
+def _lstm_bias_initializer(num_units, forget_bias):
+  """Returns an initializer for an `[i, j, f, o]` gate bias of `4 * num_units`.
+
+  The `f` slice starts at `forget_bias` and the other gates at zero, so the
+  forget bias costs nothing at run time.
+  """
+  def _initializer(shape, dtype=dtypes.float32, partition_info=None):
+    del shape, partition_info  # Unused.
+    return constant_op.constant(
+        [0.0] * (2 * num_units) + [forget_bias] * num_units +
+        [0.0] * num_units, dtype=dtype)
+  return _initializer
+
+
+def _outside_control_flow(fn):
+  """Calls `fn` with no control flow context and no control dependencies.
+
+  Ops built by `fn` run once per `Session.run`, even if the caller is inside
+  the body of a `while_loop`; reading their results from the loop adds an
+  `Enter` op only.
+  """
+  graph = ops.get_default_graph()
+  # pylint: disable=protected-access
+  outer_context = graph._get_control_flow_context()
+  graph._set_control_flow_context(None)
+  try:
+    with ops.control_dependencies(None):
+      return fn()
+  finally:
+    graph._set_control_flow_context(outer_context)
+  # pylint: enable=protected-access
+
+
+@ops.RegisterGradient(_NN_MATMUL_GRAD)
+def _nn_matmul_grad(op, grad):
+  """Gradient of an untransposed MatMul with the transposes made explicit.
+
+  The stock gradient issues `grad * kernel^T` and `x^T * grad` as transposed
+  GEMMs, which cuBLAS runs noticeably slower than the plain `NN` form.
+  A kernel entered into a `while_loop` unchanged is transposed once per run,
+  outside the loop, instead of on every backward step.
+  """
+  x, kernel = op.inputs
+  source = kernel
+  while (source.op.type in ("Enter", "RefEnter") and
+         source.op.get_attr("is_constant")):
+    source = source.op.inputs[0]
+  # pylint: disable=protected-access
+  if (source is not kernel and
+      source.op._get_control_flow_context() is None):
+    kernel_t = _outside_control_flow(lambda: array_ops.transpose(source))
+  else:
+    kernel_t = array_ops.transpose(kernel)
+  # pylint: enable=protected-access
+  return (math_ops.matmul(grad, kernel_t),
+          math_ops.matmul(array_ops.transpose(x), grad))
+
+
+def _fused_linear(x, kernel, bias=None, compute_dtype=None):
+  """`x * kernel + bias` for variables owned by the calling cell.
+
+  Args:
+    x: 2D Tensor, batch x n.
+    kernel: 2D weight, n x output_size.
+    bias: (optional) 1D bias of output_size, added with a single `bias_add`.
+    compute_dtype: (optional) dtype to run the matmul in, the result is cast
+      back to `x.dtype`.  `x` is cast on every call, `kernel` only if it is
+      not already of `compute_dtype`, so a kernel cast once outside the
+      `while_loop` is read as is.
+
+  Returns:
+    A 2D Tensor, batch x output_size, of `x.dtype`.  Its backward pass uses
+    `_nn_matmul_grad`.
+  """
+  with ops.get_default_graph().gradient_override_map(
+      {"MatMul": _NN_MATMUL_GRAD}):
+    if compute_dtype is None:
+      res = math_ops.matmul(x, kernel)
+    else:
+      if kernel.dtype.base_dtype != compute_dtype:
+        kernel = math_ops.cast(kernel, compute_dtype)
+      res = math_ops.cast(
+          math_ops.matmul(math_ops.cast(x, compute_dtype), kernel), x.dtype)
+  if bias is not None:
+    res = nn_ops.bias_add(res, bias)
+  return res
+
+
 class RNNCell(base_layer.Layer):
   """Abstract object representing an RNN cell.
 
@@ -182,17 +284,30 @@ class RNNCell(base_layer.Layer):
                              custom_getter=self._rnn_get_variable):
         return super(RNNCell, self).__call__(inputs, state)
 
+  def __init__(self, *args, **kwargs):
+    super(RNNCell, self).__init__(*args, **kwargs)
+    # Variables already filed by _rnn_get_variable, for O(1) lookups.
+    self._rnn_variables = set()
+    # zero_state results for static batch sizes of one graph, see zero_state.
+    self._zero_state_graph = None
+    self._zero_state_cache = {}
+
   def _rnn_get_variable(self, getter, *args, **kwargs):
     variable = getter(*args, **kwargs)
-    if context.in_graph_mode():
-      trainable = (variable in tf_variables.trainable_variables() or
-                   (isinstance(variable, tf_variables.PartitionedVariable) and
-                    list(variable)[0] in tf_variables.trainable_variables()))
-    else:
-      trainable = variable._trainable  # pylint: disable=protected-access
-    if trainable and variable not in self._trainable_weights:
+    if variable in self._rnn_variables:
+      return variable
+    self._rnn_variables.add(variable)
+    first = (list(variable)[0]
+             if isinstance(variable, tf_variables.PartitionedVariable)
+             else variable)
+    # Read the flag off the variable instead of scanning the global
+    # trainable collection, which made building a large model quadratic.
+    trainable = getattr(first, "trainable", getattr(first, "_trainable", None))
+    if trainable is None:
+      trainable = first in tf_variables.trainable_variables()
+    if trainable:
       self._trainable_weights.append(variable)
-    elif not trainable and variable not in self._non_trainable_weights:
+    else:
       self._non_trainable_weights.append(variable)
     return variable
 
@@ -230,9 +345,40 @@ class RNNCell(base_layer.Layer):
       a nested list or tuple (of the same structure) of `2-D` tensors with
       the shapes `[batch_size x s]` for each s in `state_size`.
     """
+    state_size = self.state_size
+    # Zero tensors are immutable, so a static batch size can share one set of
+    # them per control flow context and device instead of new ops per call.
+    cache_key = None
+    graph = ops.get_default_graph()
+    # Zeros cached outside a control_dependencies block would silently drop
+    # its dependencies, so calls inside one always build new ops.
+    # pylint: disable=protected-access
+    control_deps = graph._control_dependencies_stack
+    # pylint: enable=protected-access
+    if isinstance(batch_size, numbers.Integral) and not control_deps:
+      if (self._zero_state_graph is None or
+          self._zero_state_graph() is not graph):
+        # Only the graph being built is cached, so a cell used across graphs
+        # does not keep all of them alive.
+        self._zero_state_graph = weakref.ref(graph)
+        self._zero_state_cache = {}
+      # The device stack keeps towers of a cell shared across tf.device
+      # scopes from reading another tower's zeros.  It holds the device
+      # functions themselves and every tf.device block pushes a new one, so
+      # zeros are only shared between calls in the same tf.device block (or
+      # outside of any); each block builds its own, as without the cache.
+      # pylint: disable=protected-access
+      cache_key = (graph._get_control_flow_context(),
+                   tuple(graph._device_function_stack), batch_size,
+                   dtypes.as_dtype(dtype))
+      # pylint: enable=protected-access
+      if cache_key in self._zero_state_cache:
+        return self._zero_state_cache[cache_key]
     with ops.name_scope(type(self).__name__ + "ZeroState", values=[batch_size]):
-      state_size = self.state_size
-      return _zero_state_tensors(state_size, batch_size, dtype)
+      zeros = _zero_state_tensors(state_size, batch_size, dtype)
+    if cache_key is not None:
+      self._zero_state_cache[cache_key] = zeros
+    return zeros
 
 
 _LSTMStateTuple = collections.namedtuple("LSTMStateTuple", ("c", "h"))
@@ -285,7 +431,7 @@ class LSTMCell(RNNCell):
                initializer=None, num_proj=None, proj_clip=None,
                num_unit_shards=None, num_proj_shards=None,
                forget_bias=1.0, state_is_tuple=True,
-               activation=None, reuse=None):
+               activation=None, reuse=None, compute_dtype=None):
     """Initialize the parameters for an LSTM cell.
 
     Args:
@@ -306,8 +452,10 @@ class LSTMCell(RNNCell):
         Use a variable_scope partitioner instead.
       forget_bias: Biases of the forget gate are initialized by default to 1
         in order to reduce the scale of forgetting at the beginning of
-        the training. Must set it manually to `0.0` when restoring from
-        CudnnLSTM trained checkpoints.
+        the training.  It is only used to initialize the `f` slice of the
+        bias, so CudnnLSTM trained checkpoints can be restored as is.  Like
+        cuDNN, the cell keeps separate input (`bias`) and recurrent
+        (`recurrent_bias`) gate biases and adds them up before use.
       state_is_tuple: If True, accepted and returned states are 2-tuples of
         the `c_state` and `m_state`.  If False, they are concatenated
         along the column axis.  This latter behavior will soon be deprecated.
@@ -315,9 +463,20 @@ class LSTMCell(RNNCell):
       reuse: (optional) Python boolean describing whether to reuse variables
         in an existing scope.  If not `True`, and the existing scope already has
         the given variables, an error is raised.
+      compute_dtype: (optional) `tf.float16` or `tf.bfloat16`.  If set, the
+        gate matmul runs in this dtype so it can use Tensor Cores.  Variables
+        stay in the input dtype as master copies; the kernel is cast to
+        `compute_dtype` once per run, outside the time loop, and every step
+        reads that copy.  The gate and cell state math stays in the input
+        dtype.  `num_units` must then be a multiple of 8.
 
-      When restoring from CudnnLSTM-trained checkpoints, must use
-      CudnnCompatibleLSTMCell instead.
+      To restore CudnnLSTM-trained opaque params, build the cell and run
+      `load_cudnn_checkpoint`.  To run a vanilla cell over whole sequences in
+      a single cuDNN kernel, use `fused_dynamic_rnn`.
+
+    Raises:
+      ValueError: If `compute_dtype` is set and `num_units` is not a multiple
+        of 8.
     """
     super(LSTMCell, self).__init__(_reuse=reuse)
     if not state_is_tuple:
@@ -328,6 +487,12 @@ class LSTMCell(RNNCell):
           "%s: The num_unit_shards and proj_unit_shards parameters are "
           "deprecated and will be removed in Jan 2017.  "
           "Use a variable scope with a partitioner instead.", self)
+    if compute_dtype is not None:
+      compute_dtype = dtypes.as_dtype(compute_dtype)
+      if num_units % 8:
+        raise ValueError("num_units must be a multiple of 8 to use Tensor "
+                         "Cores with compute_dtype %s, got %d."
+                         % (compute_dtype.name, num_units))
 
     self._num_units = num_units
     self._use_peepholes = use_peepholes
@@ -340,6 +505,7 @@ class LSTMCell(RNNCell):
     self._forget_bias = forget_bias
     self._state_is_tuple = state_is_tuple
     self._activation = activation or math_ops.tanh
+    self._compute_dtype = compute_dtype
 
     if num_proj:
       self._state_size = (
@@ -351,12 +517,15 @@ class LSTMCell(RNNCell):
           LSTMStateTuple(num_units, num_units)
           if state_is_tuple else 2 * num_units)
       self._output_size = num_units
-    self._linear1 = None
-    self._linear2 = None
-    if self._use_peepholes:
-      self._w_f_diag = None
-      self._w_i_diag = None
-      self._w_o_diag = None
+    self._kernel = None
+    self._bias = None
+    self._recurrent_bias = None
+    self._folded_gate_bias = None
+    self._compute_kernel = None
+    self._proj_kernel = None
+    self._w_f_diag = None
+    self._w_i_diag = None
+    self._w_o_diag = None
 
   @property
   def state_size(self):
@@ -366,6 +535,133 @@ class LSTMCell(RNNCell):
   def output_size(self):
     return self._output_size
 
+  @property
+  def _gate_bias(self):
+    """The `[4 * num_units]` gate bias, input plus recurrent bias."""
+    if self._folded_gate_bias is not None:
+      return self._folded_gate_bias
+    return self._bias + self._recurrent_bias
+
+  @property
+  def _gate_kernel(self):
+    """The gate kernel, cast to `compute_dtype` once per run if that is set."""
+    if self._compute_kernel is not None:
+      return self._compute_kernel
+    return self._kernel
+
+  @property
+  def _cudnn_compatible(self):
+    """Whether this cell computes exactly what a cuDNN LSTM layer computes."""
+    return (not self._use_peepholes and self._num_proj is None and
+            self._cell_clip is None and self._num_unit_shards is None and
+            self._compute_dtype is None and self._activation is math_ops.tanh)
+
+  def load_cudnn_checkpoint(self, params):
+    """Returns an op assigning cuDNN opaque `params` to this cell's variables.
+
+    `params` must come from a single layer, unidirectional CudnnLSTM with the
+    same `num_units` and input size, e.g. a restored `CudnnLSTM` layer's
+    opaque params.  The eight cuDNN weight matrices and bias vectors are
+    reordered from cuDNN's `[i, f, c, o]` gate order to `[i, j, f, o]`; the
+    input and recurrent biases land in `bias` and `recurrent_bias`
+    unchanged.
+
+    Args:
+      params: 1D opaque cuDNN parameter buffer.
+
+    Returns:
+      An op that performs the assignment.
+
+    Raises:
+      ValueError: If the cell is not built yet, or does not compute the same
+        function as a cuDNN LSTM.
+    """
+    if not self.built:
+      raise ValueError("%s must be built before loading cuDNN params." % self)
+    if not self._cudnn_compatible:
+      raise ValueError("%s has no cuDNN equivalent." % self)
+    n = self._num_units
+    weights, biases = cudnn_rnn_ops.cudnn_rnn_opaque_params_to_canonical(
+        "lstm", 1, n, self._input_size, params)
+    w_i, w_f, w_c, w_o = [array_ops.reshape(w, [n, self._input_size])
+                          for w in weights[:4]]
+    r_i, r_f, r_c, r_o = [array_ops.reshape(r, [n, n]) for r in weights[4:]]
+    b_wi, b_wf, b_wc, b_wo, b_ri, b_rf, b_rc, b_ro = biases
+    kernel = array_ops.concat(
+        [array_ops.transpose(array_ops.concat([w, r], 1))
+         for w, r in ((w_i, r_i), (w_c, r_c), (w_f, r_f), (w_o, r_o))], 1)
+    return control_flow_ops.group(
+        state_ops.assign(self._kernel, kernel),
+        state_ops.assign(self._bias,
+                         array_ops.concat([b_wi, b_wc, b_wf, b_wo], 0)),
+        state_ops.assign(self._recurrent_bias,
+                         array_ops.concat([b_ri, b_rc, b_rf, b_ro], 0)))
+
+  def build(self, inputs_shape):
+    """Create the gate kernel, bias, peephole and projection variables once.
+
+    Args:
+      inputs_shape: TensorShape of the `inputs` of the first call.
+
+    Raises:
+      ValueError: If input size cannot be inferred from inputs via
+        static shape inference.
+    """
+    input_size = inputs_shape.with_rank(2)[1]
+    if input_size.value is None:
+      raise ValueError("Could not infer input size from inputs.get_shape()[-1]")
+    self._input_size = input_size.value
+    num_proj = self._num_units if self._num_proj is None else self._num_proj
+    dtype = self.dtype
+
+    scope = vs.get_variable_scope()
+    with vs.variable_scope(
+        scope, initializer=self._initializer) as unit_scope:
+      if self._num_unit_shards is not None:
+        unit_scope.set_partitioner(
+            partitioned_variables.fixed_size_partitioner(
+                self._num_unit_shards))
+      self._kernel = vs.get_variable(
+          _WEIGHTS_VARIABLE_NAME,
+          [self._input_size + num_proj, 4 * self._num_units], dtype=dtype)
+      with vs.variable_scope(unit_scope) as inner_scope:
+        inner_scope.set_partitioner(None)
+        self._bias = vs.get_variable(
+            _BIAS_VARIABLE_NAME, [4 * self._num_units], dtype=dtype,
+            initializer=_lstm_bias_initializer(self._num_units,
+                                               self._forget_bias))
+        self._recurrent_bias = vs.get_variable(
+            _RECURRENT_BIAS_VARIABLE_NAME, [4 * self._num_units], dtype=dtype,
+            initializer=init_ops.zeros_initializer())
+        # Diagonal connections
+        if self._use_peepholes:
+          self._w_f_diag = vs.get_variable(
+              "w_f_diag", shape=[self._num_units], dtype=dtype)
+          self._w_i_diag = vs.get_variable(
+              "w_i_diag", shape=[self._num_units], dtype=dtype)
+          self._w_o_diag = vs.get_variable(
+              "w_o_diag", shape=[self._num_units], dtype=dtype)
+        if self._num_proj is not None:
+          with vs.variable_scope("projection") as proj_scope:
+            if self._num_proj_shards is not None:
+              proj_scope.set_partitioner(
+                  partitioned_variables.fixed_size_partitioner(
+                      self._num_proj_shards))
+            self._proj_kernel = vs.get_variable(
+                _WEIGHTS_VARIABLE_NAME, [self._num_units, self._num_proj],
+                dtype=dtype)
+    if context.in_graph_mode():
+      # Add the biases up once per run, not on every step of the while_loop
+      # the first call is usually built in.
+      self._folded_gate_bias = _outside_control_flow(
+          lambda: self._bias + self._recurrent_bias)
+      if self._compute_dtype is not None:
+        # Likewise one reduced precision copy of the kernel per run, instead
+        # of reading the master copy and writing a new copy on every step.
+        self._compute_kernel = _outside_control_flow(
+            lambda: math_ops.cast(self._kernel, self._compute_dtype))
+    self.built = True
+
   def call(self, inputs, state):
     """Run one step of LSTM.
 
@@ -386,79 +682,51 @@ class LSTMCell(RNNCell):
            num_units otherwise.
       - Tensor(s) representing the new state of LSTM after reading `inputs` when
         the previous state was `state`.  Same type and shape(s) as `state`.
-
-    Raises:
-      ValueError: If input size cannot be inferred from inputs via
-        static shape inference.
     """
     num_proj = self._num_units if self._num_proj is None else self._num_proj
     sigmoid = math_ops.sigmoid
+    activation = self._activation
 
     if self._state_is_tuple:
       (c_prev, m_prev) = state
     else:
-      c_prev = array_ops.slice(state, [0, 0], [-1, self._num_units])
-      m_prev = array_ops.slice(state, [0, self._num_units], [-1, num_proj])
-
-    dtype = inputs.dtype
-    input_size = inputs.get_shape().with_rank(2)[1]
-    if input_size.value is None:
-      raise ValueError("Could not infer input size from inputs.get_shape()[-1]")
-    if self._linear1 is None:
-      scope = vs.get_variable_scope()
-      with vs.variable_scope(
-          scope, initializer=self._initializer) as unit_scope:
-        if self._num_unit_shards is not None:
-          unit_scope.set_partitioner(
-              partitioned_variables.fixed_size_partitioner(
-                  self._num_unit_shards))
-        self._linear1 = _Linear([inputs, m_prev], 4 * self._num_units, True)
+      c_prev, m_prev = array_ops.split(state, [self._num_units, num_proj],
+                                       axis=1)
 
     # i = input_gate, j = new_input, f = forget_gate, o = output_gate
-    lstm_matrix = self._linear1([inputs, m_prev])
-    i, j, f, o = array_ops.split(
-        value=lstm_matrix, num_or_size_splits=4, axis=1)
-    # Diagonal connections
-    if self._use_peepholes and not self._w_f_diag:
-      scope = vs.get_variable_scope()
-      with vs.variable_scope(
-          scope, initializer=self._initializer) as unit_scope:
-        with vs.variable_scope(unit_scope):
-          self._w_f_diag = vs.get_variable(
-              "w_f_diag", shape=[self._num_units], dtype=dtype)
-          self._w_i_diag = vs.get_variable(
-              "w_i_diag", shape=[self._num_units], dtype=dtype)
-          self._w_o_diag = vs.get_variable(
-              "w_o_diag", shape=[self._num_units], dtype=dtype)
+    # One [batch, input_size + num_proj] x [input_size + num_proj, 4 * units]
+    # GEMM over the concatenated input and recurrent state.
+    xh = array_ops.concat([inputs, m_prev], 1)
+    lstm_matrix = _fused_linear(xh, self._gate_kernel, self._gate_bias,
+                                self._compute_dtype)
+    # Everything between the gate matmul and the projection is pointwise, so
+    # let XLA fuse it into a single kernel.  No variables may be created here.
+    with jit.experimental_jit_scope():
+      # Column slices, the forget bias is already part of the gate bias.
+      n = self._num_units
+      i = lstm_matrix[:, :n]
+      j = lstm_matrix[:, n:2 * n]
+      f = lstm_matrix[:, 2 * n:3 * n]
+      o = lstm_matrix[:, 3 * n:]
+
+      if self._use_peepholes:
+        c = (sigmoid(f + self._w_f_diag * c_prev) * c_prev +
+             sigmoid(i + self._w_i_diag * c_prev) * activation(j))
+      else:
+        c = sigmoid(f) * c_prev + sigmoid(i) * activation(j)
 
-    if self._use_peepholes:
-      c = (sigmoid(f + self._forget_bias + self._w_f_diag * c_prev) * c_prev +
-           sigmoid(i + self._w_i_diag * c_prev) * self._activation(j))
-    else:
-      c = (sigmoid(f + self._forget_bias) * c_prev + sigmoid(i) *
-           self._activation(j))
+      if self._cell_clip is not None:
+        # pylint: disable=invalid-unary-operand-type
+        c = clip_ops.clip_by_value(c, -self._cell_clip, self._cell_clip)
+        # pylint: enable=invalid-unary-operand-type
 
-    if self._cell_clip is not None:
-      # pylint: disable=invalid-unary-operand-type
-      c = clip_ops.clip_by_value(c, -self._cell_clip, self._cell_clip)
-      # pylint: enable=invalid-unary-operand-type
-    
-    if self._use_peepholes:
-      m = sigmoid(o + self._w_o_diag * c) * self._activation(c)
-    else:
-      m = sigmoid(o) * self._activation(c)
+      if self._use_peepholes:
+        m = sigmoid(o + self._w_o_diag * c) * activation(c)
+      else:
+        m = sigmoid(o) * activation(c)
 
     if self._num_proj is not None:
-      if self._linear2 is None:
-        scope = vs.get_variable_scope()
-        with vs.variable_scope(scope, initializer=self._initializer):
-          with vs.variable_scope("projection") as proj_scope:
-            if self._num_proj_shards is not None:
-              proj_scope.set_partitioner(
-                  partitioned_variables.fixed_size_partitioner(
-                      self._num_proj_shards))
-            self._linear2 = _Linear(m, self._num_proj, False)
-      m = self._linear2(m)
+      m = _fused_linear(m, self._proj_kernel)
 
       if self._proj_clip is not None:
         # pylint: disable=invalid-unary-operand-type
@@ -524,19 +792,16 @@ class LN_LSTMCell(RNNCell):
       self._state_size = (LSTMStateTuple(num_units, num_units) if state_is_tuple else num_units + num_units)
       self._output_size = num_units
 
-    self._linear1 = None
-    self._linear2 = None
-    if self._use_peepholes:
-      self._w_f_diag = None
-      self._w_i_diag = None
-      self._w_o_diag = None
-    self._ln_i = None
-    self._ln_j = None
-    self._ln_f = None
-    self._ln_o = None
-    if self._use_peepholes:
-      self._ln_p1 = None
-      self._ln_p2 = None
+    self._kernel = None
+    self._bias = None
+    self._proj_kernel = None
+    # all set by build(), the peephole ones only if use_peepholes
+    self._w_f_diag = None
+    self._w_i_diag = None
+    self._w_o_diag = None
+    self._ln_gates = None
+    self._ln_p1 = None
+    self._ln_p2 = None
     self._ln_c = None
 
   @property
@@ -547,6 +812,39 @@ class LN_LSTMCell(RNNCell):
     return self._output_size
   
 
+  def build(self, inputs_shape):
+    """
+      Create kernel, bias, peephole, projection and layer normalization variables once, before the first step.
+
+      Args:
+        inputs_shape: TensorShape of the 'inputs' of the first call.
+    """
+    input_size = inputs_shape.with_rank(2)[1]
+    if input_size.value is None:
+      raise ValueError('Could not infer input size from inputs.get_shape()[-1]')
+    self._input_size = input_size.value
+    num_proj = self._num_units if self._num_proj is None else self._num_proj
+    dtype = self.dtype
+
+    scope = vs.get_variable_scope()
+    with vs.variable_scope(scope, initializer=self._initializer):
+      self._kernel = vs.get_variable(_WEIGHTS_VARIABLE_NAME, [self._input_size + num_proj, 4 * self._num_units], dtype=dtype)
+      self._bias = vs.get_variable(_BIAS_VARIABLE_NAME, [4 * self._num_units], dtype=dtype, initializer=init_ops.constant_initializer(0.0, dtype=dtype))
+      # diagonal connections
+      if self._use_peepholes:
+        self._w_f_diag = vs.get_variable("w_f_diag", shape=[self._num_units], dtype=dtype)
+        self._w_i_diag = vs.get_variable("w_i_diag", shape=[self._num_units], dtype=dtype)
+        self._w_o_diag = vs.get_variable("w_o_diag", shape=[self._num_units], dtype=dtype)
+        self._ln_p1 = Layer_Normalization([self._num_units], scope='p1_norm')
+        self._ln_p2 = Layer_Normalization([self._num_units], scope='p2_norm')
+      if self._num_proj is not None:
+        with vs.variable_scope("projection"):
+          self._proj_kernel = vs.get_variable(_WEIGHTS_VARIABLE_NAME, [self._num_units, self._num_proj], dtype=dtype)
+    # one [4, num_units] gain/bias, normalized per gate over the last axis
+    self._ln_gates = Layer_Normalization([4, self._num_units], scope='ijfo_norm')
+    self._ln_c = Layer_Normalization([self._num_units], scope='c_norm')
+    self.built = True
+
   def call(self, inputs, state):
     """
       Run one step of cell,
@@ -557,75 +855,38 @@ class LN_LSTMCell(RNNCell):
     """
     num_proj = self._num_units if self._num_proj is None else self._num_proj
     sigmoid = math_ops.sigmoid
+    activation = self._activation
 
     if self._state_is_tuple:
       (c_prev, m_prev) = state
     else:
-      c_prev = array_ops.slice(state, [0, 0], [-1, self._num_units])
-      m_prev = array_ops.slice(state, [0, self._num_units] , [-1, num_proj])
-
-    dtype = inputs.dtype
-    input_size = inputs.get_shape().with_rank(2)[1]
-    if input_size.value is None:
-      raise ValueError('Could not infer input size from inputs.get_shape()[-1]')
-    if self._linear1 is None:
-      scope = vs.get_variable_scope()
-      with vs.variable_scope(scope, initializer=self._initializer) as unit_scope:
-        self._linear1 = _Linear([inputs, m_prev], 4 * self._num_units, True)
-    lstm_matrix = self._linear1([inputs, m_prev])
-    # i=input_gate, j=new_input, f=forget_gate, o=output_gate
-    i,j,f,o = array_ops.split(value=lstm_matrix, num_or_size_splits=4, axis=1)
-    if self._ln_i is None:
-      self._ln_i = Layer_Normalization([self._num_units], scope='i_norm')
-    if self._ln_j is None:
-      self._ln_j = Layer_Normalization([self._num_units], scope='j_norm')
-    if self._ln_f is None:
-      self._ln_f = Layer_Normalization([self._num_units], scope='f_norm')
-    if self._ln_o is None:
-      self._ln_o = Layer_Normalization([self._num_units], scope='o_norm')
-    i = self._ln_i(i)
-    j = self._ln_j(j)
-    f = self._ln_f(f)
-    o = self._ln_o(o)
-    
-    # diagonal connections
-    if self._use_peepholes and not self._w_f_diag:
-      scope = vs.get_variable_scope()
-      with vs.variable_scope(scope, initializer=self._initializer) as unit_scope:
-        with vs.variable_scope(unit_scope):
-          self._w_f_diag = vs.get_variable("w_f_diag", shape=[self._num_units], dtype=dtype)
-          self._w_i_diag = vs.get_variable("w_i_diag", shape=[self._num_units], dtype=dtype)
-          self._w_o_diag = vs.get_variable("w_o_diag", shape=[self._num_units], dtype=dtype)
-          if self._ln_p1 is None:
-            self._ln_p1 = Layer_Normalization([self._num_units], scope='p1_norm')
-          if self._ln_p2 is None:
-            self._ln_p2 = Layer_Normalization([self._num_units], scope='p2_norm')
-    if self._use_peepholes:
-      peep1 = self._w_f_diag * c_prev
-      #if self._ln_p1 is None:
-      #  self._ln_p1 = Layer_Normalization([self._num_units], scope='p1_norm')
-      peep2 = self._w_i_diag*c_prev
-      #if self._ln_p2 is None:
-      #  self._ln_p2 = Layer_Normalization([self._num_units], scope='p2_norm')
-      c = (sigmoid(f + self._forget_bias + self._ln_p1(peep1)) + sigmoid(i + self._ln_p2(peep2)) * self._activation(j))
-    else:
-      c = (sigmoid(f + self._forget_bias) * c_prev + sigmoid(i) * self._activation(j))
-    if self._ln_c is None:
-      self._ln_c = Layer_Normalization([self._num_units], scope='c_norm')
-    c = self._ln_c(c)
-    if self._use_peepholes:
-      m = sigmoid(o + self._w_o_diag * c) * self._activation(c)
-    else:
-      m = sigmoid(o) * self._activation(c)
+      c_prev, m_prev = array_ops.split(state, [self._num_units, num_proj], axis=1)
+
+    # single GEMM over the concatenated [inputs, m_prev]
+    xh = array_ops.concat([inputs, m_prev], 1)
+    lstm_matrix = _fused_linear(xh, self._kernel, self._bias)
+    # gate math up to the projection is pointwise plus small reductions, fuse it with XLA.
+    # all variables come from build(), none may be created in this scope.
+    with jit.experimental_jit_scope():
+      # i=input_gate, j=new_input, f=forget_gate, o=output_gate
+      # normalize all four gates with one reduction over [batch, 4, num_units]
+      gates = self._ln_gates(array_ops.reshape(lstm_matrix, [-1, 4, self._num_units]))
+      i, j, f, o = array_ops.unstack(gates, axis=1)
+
+      if self._use_peepholes:
+        peep1 = self._w_f_diag * c_prev
+        peep2 = self._w_i_diag*c_prev
+        c = (sigmoid(f + self._forget_bias + self._ln_p1(peep1)) * c_prev + sigmoid(i + self._ln_p2(peep2)) * activation(j))
+      else:
+        c = (sigmoid(f + self._forget_bias) * c_prev + sigmoid(i) * activation(j))
+      c = self._ln_c(c)
+      if self._use_peepholes:
+        m = sigmoid(o + self._w_o_diag * c) * activation(c)
+      else:
+        m = sigmoid(o) * activation(c)
 
     if self._num_proj is not None:
-      if self._linear2 is None:
-        scope = vs.get_variable_scope()
-        with vs.variable_scope(scope, initializer=self._initializer):
-          with vs.variable_scope("projection") as proj_scope:
-            self._linear2 = _Linear(m, self._num_proj, False)
-            
-      m = self._linear2(m)
+      m = _fused_linear(m, self._proj_kernel)
 
       if self._proj_clip is not None:
         m = clip_ops.clip_by_value(m, -self._proj_clip, self._proj_clip)
@@ -635,78 +896,108 @@ class LN_LSTMCell(RNNCell):
 
 
 class Layer_Normalization(object):
+  """
+    Layer normalization over the last axis of its inputs. 'dim' is the shape of the gain and bias,
+    e.g. [num_units] for [batch, num_units] inputs or [4, num_units] to normalize each of 4 gates
+    of a [batch, 4, num_units] tensor separately. 'dtype' is the storage type of gain and bias, they are cast
+    to the dtype of the inputs when applied.
+  """
 
-  def __init__(self, dim, scope="layer_normalization",  epsilon=1e-5):
+  def __init__(self, dim, scope="layer_normalization",  epsilon=1e-5, dtype=tf.float32):
     self._epsilon = epsilon
     with vs.variable_scope(scope) as var_scope:
-      self._g = vs.get_variable('gain',dim, initializer=tf.ones_initializer(), dtype=tf.float32)
-      self._b = vs.get_variable('bias',dim, initializer=tf.zeros_initializer(), dtype=tf.float32)
+      self._g = vs.get_variable('gain',dim, initializer=tf.ones_initializer(), dtype=dtype)
+      self._b = vs.get_variable('bias',dim, initializer=tf.zeros_initializer(), dtype=dtype)
 
   def __call__(self, inputs):
-      m, v = tf.nn.moments(inputs, [1], keep_dims=True)
-      norm_inputs = (inputs - m) / tf.sqrt(v + self._epsilon)
-      return norm_inputs * self._g + self._b
+    # moments, normalize and affine as one XLA cluster, so inputs is streamed once
+    with jit.experimental_jit_scope():
+      # E[x] and E[x^2] are independent reductions over one read of inputs,
+      # unlike tf.nn.moments which needs the mean before the second pass.
+      m = tf.reduce_mean(inputs, [-1], keep_dims=True)
+      v = tf.maximum(tf.reduce_mean(tf.square(inputs), [-1], keep_dims=True) - tf.square(m), 0.)
+      # normalize, scale and shift as inputs * a + (bias - m * a) with
+      # a = gain * rsqrt(v + eps), no division and no separate affine step.
+      g = tf.cast(self._g, inputs.dtype)
+      b = tf.cast(self._b, inputs.dtype)
+      return tf.nn.batch_normalization(inputs, m, v, b, g, self._epsilon)
     
-def orthogonal(shape):
-  flat_shape = (shape[0], np.prod(shape[1:]))
-  a = np.random.normal(0.0, 1.0, flat_shape)
-  u, _, v = np.linalg.svd(a, full_matrices=False)
-  q = u if u.shape == flat_shape else v
-  return q.reshape(shape)
-
-def lstm_ortho_initializer(scale=1.0):
+
+
+
+def _group_matmul(z, w):
+  """
+    Per group matmul of z [batch, groups*embedding_size] with w [groups, embedding_size, num_units],
+    done as one batched matmul, returns [batch, groups, num_units].
+  """
+  groups, embedding_size, _ = w.get_shape().as_list()
+  z = tf.transpose(tf.reshape(z, [-1, groups, embedding_size]), [1, 0, 2])
+  return tf.transpose(tf.matmul(z, w), [1, 0, 2])
+
+
+def _stacked_initializer(initializers, axis=0):
+  """
+    Initializer for a variable made of len(initializers) equal blocks along 'axis', block k from initializers[k].
+  """
   def _initializer(shape, dtype=tf.float32, partition_info=None):
-    size_x = shape[0]
-    size_h = shape[1]/4
-    t = np.zeros(shape)
-    t[:, :size_h] = orthogonal([size_x, size_h]) * scale
-    t[:, size_h: size_h*2] = orthogonal([size_x, size_h]) * scale
-    t[:, size_h*2: size_h*3] = orthogonal([size_x, size_h]) * scale
-    t[:, size_h*3: ] = orthogonal([size_x, size_h] * scale)
-    return tf.constant(t,dtype)
+    block = list(shape)
+    if block[axis] % len(initializers):
+      raise ValueError('Cannot split axis %d of shape %s into %d equal blocks.' % (axis, shape, len(initializers)))
+    block[axis] //= len(initializers)
+    return tf.concat([init(block, dtype=dtype) for init in initializers], axis)
   return _initializer
 
 
+class _HyperScaleBias(object):
+  """
+    Hyper scales and hyper bias of each gate of num_layers [batch, num_gates, num_units] activations, every gate of
+    every layer with its own scale embedding and every gate with its own bias embedding. All (num_layers+1)*num_gates
+    embeddings come from one matmul and all scales and biases from one batched matmul, so no per gate or per kind
+    intermediates are built.
+  """
 
-def _h_linear(x, output_size, scope=None, reuse=False,
-              init_w="ortho", weight_start=0.0, use_bias=True, bias_start=0.0, input_size=None):
-  shape = x.get_shape().as_list()
-  with tf.variable_scope(scope or 'linear'):
-    if reuse == True:
-      tf.get_variable_scope().reuse_variables()
-    w_init = None
-    if input_size == None:
-      x_size = shape[1]
-    else:
-      x_size = output_size
-    if init_w =='zeros':
-      w_init = tf.constant_initializer(0.0)
-    elif init_w == 'constant':
-      w_init = tf.constant_initializer(weight_start)
-    elif init_w == 'gaussian':
-      w_init = tf.random_normal_initializer(stddev=weight_start)
-    elif init_w == 'ortho':
-      w_init=lstm_ortho_initializer(1.0)
-    w = tf.get_variable('super_linear_w', [x_size, output_size], tf.float32, initializer=w_init)
-    if use_bias:
-      b = tf.get_variable('super_linear_b', [output_size], tf.float32, initializer=tf.constant_initializer(bias_start))
-      return tf.matmul(x,w) + b
-    return tf.matmul(x,w)
-
-def _hyper_norm(layer, hyper_output, embedding_size, num_units, scope="hyper", use_bias=True):
-  init_gamma = 0.10
-  with tf.variable_scope(scope):
-    zw = _h_linear(hyper_output, embedding_size, init_w="constant", weight_start=0.0, use_bias=True, bias_start=1.0, scope='zw')
-    alpha = _h_linear(zw, num_units, init_w="constant", weight_start=init_gamma/embedding_size, use_bias=False, scope='alpha')
-    return tf.multiply(alpha, layer)
-
-
-def _hyper_bias(layer, hyper_output, embedding_size, num_units, scope="hyper"):
-  with tf.variable_scope(scope):
-    zb = _h_linear(hyper_output, embedding_size, init_w='gaussian', weight_start=0.01, use_bias=False, bias_start=0.0, scope='zb')
-    beta = _h_linear(zb, num_units, init_w='constant', weight_start=0.0, use_bias=False, scope='beta')
-  return layer + beta
+  def __init__(self, hyper_num_units, embedding_size, num_units, num_gates=4, num_layers=2, scope="hyper", compute_dtype=None):
+    init_gamma = 0.10
+    self._compute_dtype = compute_dtype
+    self._num_gates = num_gates
+    self._num_layers = num_layers
+    num_embeddings = (num_layers + 1)*num_gates
+    with tf.variable_scope(scope):
+      # scale embeddings zw of each layer, then bias embeddings zb, side by side along the embedding (column) axis
+      with tf.variable_scope('z'):
+        self._w_z = tf.get_variable('super_linear_w', [hyper_num_units, num_embeddings*embedding_size], tf.float32,
+                                    initializer=_stacked_initializer([tf.constant_initializer(0.0)]*num_layers + [tf.random_normal_initializer(stddev=0.01)], axis=1))
+        # only the scale embeddings have a bias, the bias embeddings zb never had one
+        self._b_z = tf.get_variable('super_linear_b', [num_layers*num_gates*embedding_size], tf.float32,
+                                    initializer=tf.constant_initializer(1.0))
+      # scales alpha of each layer, then biases beta
+      self._w_ab = tf.get_variable('alpha_beta', [num_embeddings, embedding_size, num_units], tf.float32,
+                                   initializer=_stacked_initializer([tf.constant_initializer(init_gamma/embedding_size)]*num_layers + [tf.constant_initializer(0.0)]))
+    # the embedding kernel in compute_dtype and the bias zero padded over the zb columns, so a step needs a single
+    # bias_add. both are made once per run outside the time loop instead of on every step
+    self._zb_size = num_gates*embedding_size
+    self._w_z_step = self._w_z
+    self._b_z_step = None
+    if context.in_graph_mode():
+      if compute_dtype is not None:
+        self._w_z_step = _outside_control_flow(lambda: tf.cast(self._w_z, compute_dtype))
+      self._b_z_step = _outside_control_flow(self._padded_b_z)
+
+  def _padded_b_z(self):
+    return tf.pad(self._b_z, [[0, self._zb_size]])
 
+  def __call__(self, layers, bias, hyper_output):
+    """
+      sum_k alpha_k * layers[k] + bias + beta, each of the num_layers layers [batch, num_gates, num_units] and bias [num_gates, num_units]
+    """
+    g = self._num_gates
+    b_z = self._b_z_step if self._b_z_step is not None else self._padded_b_z()
+    z = _fused_linear(hyper_output, self._w_z_step, b_z, self._compute_dtype)
+    ab = _group_matmul(z, self._w_ab)
+    res = bias + ab[:, self._num_layers*g:]
+    for k, layer in enumerate(layers):
+      res += ab[:, k*g:(k+1)*g] * layer
+    return res
 
 
 class H_LSTMCell(RNNCell):
@@ -726,7 +1017,9 @@ class H_LSTMCell(RNNCell):
                activation=None,
                reuse=None,
                hyper_num_units=32,
-               hyper_embed_size=16):
+               hyper_embed_size=16,
+               compute_dtype=None,
+               fp16_vectors=False):
     """
       num_units: int, number of units in cell.
       use_peepholes: bool, true to enable diagonal/peephole connections.
@@ -738,8 +1031,16 @@ class H_LSTMCell(RNNCell):
       remove state_is_tuple: bool, if True, accepted and returned states are 2-tuples of the 'c_state' and 'm_state'. If False, they are concatenated along the column axis. This latter behavior will soon be deprecated.
       activation: activation function of the inner states. Default 'tanh'
       reuse: (optional) bool, whether to reuse variables in an existing scope, If not True, and the existing scope already has the given variables, an error is raised.
+      hyper_num_units: int, number of units in the hyper LSTM cell.
+      hyper_embed_size: int, size of the per gate hyper embeddings.
+      compute_dtype: (optional) 'tf.float16' or 'tf.bfloat16', if set the gate, hyper embedding and hyper lstm matmuls run in this dtype, variables and the cell state stay in the input dtype. the kernels are cast once per run, outside the time loop. 'num_units' and 'hyper_num_units' must then be multiples of 8.
+      fp16_vectors: bool, if True the peephole diagonals and layer norm gains and biases are stored in float16 with no master copy in the input dtype, which halves their reads. updates smaller than the float16 spacing (about 1e-3 near 1.0) are lost, so only use it with large enough learning rates or for inference.
     """
     super(H_LSTMCell, self).__init__(_reuse=reuse)
+    if compute_dtype is not None:
+      compute_dtype = dtypes.as_dtype(compute_dtype)
+      if num_units % 8 or hyper_num_units % 8:
+        raise ValueError('num_units and hyper_num_units must be multiples of 8 to use Tensor Cores with compute_dtype %s, got %d and %d.' % (compute_dtype.name, num_units, hyper_num_units))
     #if not state_is_tuple:
     #  tf.logging.warn('%s: Using a concatenated state is slower and will soon be deprecated, Use state_is_tuple=True')
     self._num_units = num_units
@@ -753,32 +1054,37 @@ class H_LSTMCell(RNNCell):
     self._activation = activation or math_ops.tanh
     self._hyper_num_units = hyper_num_units
     self._hyper_embed_size = hyper_embed_size
+    self._compute_dtype = compute_dtype
+    self._fp16_vectors = fp16_vectors
 
 
+    # (main, hyper) state pair, kept apart so a step never slices or concatenates them
+    hyper_state_size = LSTMStateTuple(hyper_num_units, hyper_num_units)
     if num_proj:
-      self._state_size = (LSTMStateTuple(num_units+hyper_num_units, num_proj+hyper_num_units))
+      self._state_size = (LSTMStateTuple(num_units, num_proj), hyper_state_size)
       self._output_size = num_proj
     else:
-      self._state_size = (LSTMStateTuple(num_units+hyper_num_units, num_units+hyper_num_units))
+      self._state_size = (LSTMStateTuple(num_units, num_units), hyper_state_size)
       self._output_size = num_units
 
 
-    #self._w_h_linear = None
-    if self._use_peepholes:
-      self._w_f_diag = None
-      self._w_i_diag = None
-      self._w_o_diag = None
-    self._ln_i = None
-    self._ln_j = None
-    self._ln_f = None
-    self._ln_o = None
-    if self._use_peepholes:
-      self._ln_p1 = None
-      self._ln_p2 = None
+    # all set by build(), the peephole ones only if use_peepholes
+    self._W_xh = None
+    self._W_hh = None
+    self._bias = None
+    self._hyper_kernel = None
+    # (W_xh, W_hh, hyper recurrent kernel) as read by the steps, in compute_dtype if that is set
+    self._step_kernels = None
+    self._hyper_bias = None
+    self._hyper_wb = None
+    self._proj_kernel = None
+    self._w_fi_diag = None
+    self._w_o_diag = None
+    self._ln_gates = None
+    self._ln_p = None
     self._ln_c = None
-
-
-    self._hyper_cell = None
+    # use_peepholes is fixed for the cell's lifetime, pick the cell update once instead of per step
+    self._cell_update = self._peephole_update if use_peepholes else self._plain_update
 
   @property
   def state_size(self):
@@ -787,212 +1093,210 @@ class H_LSTMCell(RNNCell):
   def output_size(self):
     return self._output_size
 
-  def call(self, inputs, state):
+  def build(self, inputs_shape):
     """
-      run one step of cell
+      Create the gate, hyper, peephole, projection and layer normalization variables once, before the first step.
+
       Args:
-        inputs: input tensor, 2D, batch X num_units
-        state: if 'state_is_tuple' is False, this must be a state Tensor, '2D', batch x state_size. if 'state_is_tuple' is True, this must be a tuple of state Tensors, both '2D' with column size 'c_state' and 'm_state'
+        inputs_shape: TensorShape of the 'inputs' of the first call.
     """
-    num_proj = self._num_units if self._num_proj is None else self._num_proj
-    sigmoid = math_ops.sigmoid
-
-    c_t, m_t= state
-    c_prev, m_prev = c_t[:, 0:self._num_units], m_t[:, 0:self._num_units]
-    hyper_state = LSTMStateTuple(c_t[:,self._num_units:], m_t[:,self._num_units:])
-
-    w_init = None
-    h_init = lstm_ortho_initializer(1.0)
-
-
-    #if True: # self._state_is_tuple:
-      #(c_prev, m_prev) = state
-    #else:
-    #  c_prev = array_ops.slice(state, [0,0], [-1,self._num_units])
-    #  m_prev = array_ops.slice(state, [0,self._num_units], [-1,num_proj])
-    dtype = inputs.dtype
-    input_size = inputs.get_shape().with_rank(2)[1]
-
+    input_size = inputs_shape.with_rank(2)[1]
     if input_size.value is None:
       raise ValueError('Could not infer input size from inputs.get_shape()[-1]')
+    self._input_size = input_size.value
+    num_proj = self._num_units if self._num_proj is None else self._num_proj
+    dtype = self.dtype
+    # the small per unit vectors (peepholes, layer norm gain and bias) are only stored in float16 on request,
+    # they are only ever multiplied or added inside the XLA cluster where the cast to dtype fuses with the load
+    param_dtype = tf.float16 if self._fp16_vectors else dtype
 
-    batch_size = inputs.get_shape().with_rank(2)[0]
-    #print(inputs)
-    x_hat = tf.concat([inputs , m_prev],1)
-    #print(x_hat)
+    scope = vs.get_variable_scope()
+    with vs.variable_scope(scope, initializer=self._initializer):
+      # weights of the main gates and of the hyper lstm gates side by side, [.., 4*num_units + 4*hyper_num_units],
+      # so both cells share the GEMMs over inputs and m_prev. only the hyper recurrent part gets its own kernel.
+      self._W_xh = tf.get_variable('W_xh', [self._input_size, self._num_units*4 + self._hyper_num_units*4], dtype=dtype)
+      self._W_hh = tf.get_variable('W_hh', [num_proj, self._num_units*4 + self._hyper_num_units*4], dtype=dtype)
+      self._bias = tf.get_variable('W_bias', [self._num_units*4], dtype=dtype, initializer=tf.constant_initializer(0.0))
+      with vs.variable_scope('hyper_lstm'):
+        self._hyper_kernel = vs.get_variable('recurrent_kernel', [self._hyper_num_units, self._hyper_num_units*4], dtype=dtype)
+        self._hyper_bias = vs.get_variable(_BIAS_VARIABLE_NAME, [self._hyper_num_units*4], dtype=dtype, initializer=_lstm_bias_initializer(self._hyper_num_units, 1.0))
+      self._hyper_wb = _HyperScaleBias(self._hyper_num_units, self._hyper_embed_size, self._num_units, scope='hyper_wb', compute_dtype=self._compute_dtype)
+      # diagonal connections
+      if self._use_peepholes:
+        # f and i peepholes stacked as [2, num_units], so both products and both norms are one op each
+        self._w_fi_diag = vs.get_variable("w_fi_diag", shape=[2, self._num_units], dtype=param_dtype)
+        self._w_o_diag = vs.get_variable("w_o_diag", shape=[self._num_units], dtype=param_dtype)
+        self._ln_p = Layer_Normalization([2, self._num_units], scope='p_norm', dtype=param_dtype)
+      if self._num_proj is not None:
+        with vs.variable_scope("projection"):
+          self._proj_kernel = vs.get_variable(_WEIGHTS_VARIABLE_NAME, [self._num_units, self._num_proj], dtype=dtype)
+    # one [4, num_units] gain/bias, normalized per gate over the last axis
+    self._ln_gates = Layer_Normalization([4, self._num_units], scope='ijfo_norm', dtype=param_dtype)
+    self._ln_c = Layer_Normalization([self._num_units], scope='c_norm', dtype=param_dtype)
+    self._step_kernels = (self._W_xh, self._W_hh, self._hyper_kernel)
+    if self._compute_dtype is not None and context.in_graph_mode():
+      # cast the kernels once per run outside the time loop, every step only reads the reduced precision copies
+      self._step_kernels = _outside_control_flow(
+        lambda: tuple(tf.cast(w, self._compute_dtype) for w in self._step_kernels))
+    self.built = True
 
-    if self._hyper_cell is None:
-      with vs.variable_scope('hyper_lstm') as scope:
-        self._hyper_cell = LSTMCell(self._hyper_num_units)
-    h_out, new_hyper_state = self._hyper_cell(x_hat, hyper_state)
+  def call(self, inputs, state):
+    """
+      run one step of cell
+      Args:
+        inputs: input tensor, 2D, batch X num_units
+        state: pair of the main and the hyper LSTMStateTuple, '2D' tensors with column sizes 'c_state' and 'm_state' each
+    """
+    (c_prev, m_prev), hyper_state = state
+
+    # one GEMM over inputs and one over m_prev, each for the four main and the four hyper gates. the main gate
+    # products are kept apart since each gets its own hyper scale.
+    gate_sizes = [self._num_units*4, self._hyper_num_units*4]
+    W_xh, W_hh, _ = self._step_kernels
+    xh, hyper_x = tf.split(_fused_linear(inputs, W_xh, compute_dtype=self._compute_dtype), gate_sizes, 1)
+    hh, hyper_h = tf.split(_fused_linear(m_prev, W_hh, compute_dtype=self._compute_dtype), gate_sizes, 1)
+
+    # everything from here to the projection, the hyper lstm step included, is pointwise, small reductions or
+    # tiny matmuls, run it as one XLA cluster. all variables come from build(), none may be created in this scope.
+    with jit.experimental_jit_scope():
+      # the hyper lstm only needs the sum over x_hat = [inputs, m_prev]
+      h_out, new_hyper_state = self._hyper_step(hyper_x + hyper_h, hyper_state)
+
+      # the gates stay a [batch, 4, num_units] view from here to the unstack, no splits in between
+      xh = tf.reshape(xh, [-1, 4, self._num_units])
+      hh = tf.reshape(hh, [-1, 4, self._num_units])
+      # xh*scale_x + hh*scale_h + hyper bias of all four gates at once, each gate keeps its own embeddings
+      gates = self._hyper_wb([xh, hh], tf.reshape(self._bias, [4, self._num_units]), h_out)
+      # normalize all four gates with one reduction over the last axis
+      gates = self._ln_gates(gates)
+      i, j, f, o = tf.unstack(gates, axis=1)
+
+      c, m = self._cell_update(c_prev, i, j, f, o)
 
-    W_xh = tf.get_variable('W_xh', [input_size, self._num_units*4], initializer=w_init)
-    W_hh = tf.get_variable('W_hh', [input_size, self._num_units*4], initializer=w_init)
-    bias = tf.get_variable('W_bias', [self._num_units*4], initializer=tf.constant_initializer(0.0))
+    if self._num_proj is not None:
+      m = _fused_linear(m, self._proj_kernel)
+      if self._proj_clip is not None:
+        m = clip_ops.clip_by_value(m, -self._proj_clip, self._proj_clip)
+    new_state = (LSTMStateTuple(c, m), new_hyper_state)
+    return m, new_state
 
-    xh = tf.matmul(inputs, W_xh)
-    hh = tf.matmul(inputs, W_hh)
+  def _hyper_step(self, hyper_mat, hyper_state):
+    """
+      one step of the plain hyper lstm, given the x_hat part of its gate pre-activations
+    """
+    sigmoid = math_ops.sigmoid
+    c_prev, m_prev = hyper_state
+    hyper_mat = hyper_mat + _fused_linear(m_prev, self._step_kernels[2], self._hyper_bias, self._compute_dtype)
+    i, j, f, o = tf.unstack(tf.reshape(hyper_mat, [-1, 4, self._hyper_num_units]), axis=1)
+    c = sigmoid(f) * c_prev + sigmoid(i) * math_ops.tanh(j)
+    m = sigmoid(o) * math_ops.tanh(c)
+    return m, LSTMStateTuple(c, m)
+
+  def _peephole_update(self, c_prev, i, j, f, o):
+    """
+      new c and m from the normalized gates, with peephole connections
+    """
+    sigmoid = math_ops.sigmoid
+    activation = self._activation
+    w_fi_diag = tf.cast(self._w_fi_diag, c_prev.dtype)
+    w_o_diag = tf.cast(self._w_o_diag, c_prev.dtype)
+    peep1, peep2 = tf.unstack(self._ln_p(w_fi_diag * tf.expand_dims(c_prev, 1)), axis=1)
+    c = sigmoid(f + self._forget_bias + peep1) * c_prev + sigmoid(i + peep2) * activation(j)
+    c = self._ln_c(c)
+    m = sigmoid(o + w_o_diag * c) * activation(c)
+    return c, m
 
-    ix, jx, fx, ox = tf.split(xh, 4, 1)
-    ix = _hyper_norm(ix, h_out, self._hyper_embed_size, self._num_units, 'hyper_ix')
-    jx = _hyper_norm(jx, h_out, self._hyper_embed_size, self._num_units, 'hyper_jx')
-    fx = _hyper_norm(fx, h_out, self._hyper_embed_size, self._num_units, 'hyper_fx')
-    ox = _hyper_norm(ox, h_out, self._hyper_embed_size, self._num_units, 'hyper_ox')
+  def _plain_update(self, c_prev, i, j, f, o):
+    """
+      new c and m from the normalized gates, without peephole connections
+    """
+    sigmoid = math_ops.sigmoid
+    activation = self._activation
+    c = sigmoid(f + self._forget_bias) * c_prev + sigmoid(i) * activation(j)
+    c = self._ln_c(c)
+    m = sigmoid(o) * activation(c)
+    return c, m
 
 
-    ih, jh, fh, oh = tf.split(hh, 4, 1)
-    ih = _hyper_norm(ih, h_out, self._hyper_embed_size, self._num_units, 'hyper_ih')
-    jh = _hyper_norm(jh, h_out, self._hyper_embed_size, self._num_units, 'hyper_jh')
-    fh = _hyper_norm(fh, h_out, self._hyper_embed_size, self._num_units, 'hyper_fh')
-    oh = _hyper_norm(oh, h_out, self._hyper_embed_size, self._num_units, 'hyper_oh')
 
-    
-    ib, jb, fb, ob = tf.split(bias, 4, 0)
-    ib = _hyper_bias(ib, h_out, self._hyper_embed_size, self._num_units, 'hyper_ib')
-    jb = _hyper_bias(jb, h_out, self._hyper_embed_size, self._num_units, 'hyper_jb')
-    fb = _hyper_bias(fb, h_out, self._hyper_embed_size, self._num_units, 'hyper_fb')
-    ob = _hyper_bias(ob, h_out, self._hyper_embed_size, self._num_units, 'hyper_ob')
-
-    i = ix + ih + ib
-    j = jx + jh + jb
-    f = fx + fh + fb
-    o = ox + oh + ob
-    print(i)
-
-    #if self._w_h_linear is None:
-    #  with vs.variable_scope('w_h_linear') as scope:
-    #    self._w_h_linear = _Linear([])
-
-
-
-    #if self._linear1 is None:
-    #  scope = vs.get_variable_scope()
-    #  with vs.variable_scope(scope, initializer=self._initializer) as unit_scope:
-    #    self._linear1 = _Linear([inputs, m_prev], 4*self._num_units, True)
-    #lstm_matrix = self._linear1([inputs, m_prev])
-    #i,j,f,o = array_ops.split(value=lstm_matrix, num_or_size_splits=4, axis=1)
-    if self._ln_i is None:
-      self._ln_i = Layer_Normalization([self._num_units], scope='i_norm')
-    if self._ln_j is None:
-      self._ln_j = Layer_Normalization([self._num_units], scope='j_norm')
-    if self._ln_f is None:
-      self._ln_f = Layer_Normalization([self._num_units], scope='f_norm')
-    if self._ln_o is None:
-      self._ln_o = Layer_Normalization([self._num_units], scope='o_norm')
-    i,j,f,o = self._ln_i(i), self._ln_j(j), self._ln_f(f), self._ln_o(o)
-
-    if self._use_peepholes and not self._w_f_diag:
-      scope = vs.get_variable_scope()
-      with vs.variable_scope(scope, initializer=self._initializer) as unit_scope:
-        with vs.variable_scope(unit_scope):
-          self._w_f_diag = vs.get_variable("w_f_diag", shape=[self._num_units], dtype=dtype)
-          self._w_i_diag = vs.get_variable("w_i_diag", shape=[self._num_units], dtype=dtype)
-          self._w_o_diag = vs.get_variable("w_o_diag", shape=[self._num_units], dtype=dtype)
-          if self._ln_p1 is None:
-            self._ln_p1 = Layer_Normalization([self._num_units], scope='p1_norm')
-          if self._ln_p2 is None:
-            self._ln_p2 = Layer_Normalization([self._num_units], scope='p2_norm')
-    if self._use_peepholes:
-      peep1 = self._w_f_diag * c_prev
-      peep2 = self._w_i_diag * c_prev
-      c = (sigmoid(f + self._forget_bias + self._ln_p1(peep1)) + sigmoid(i + self._ln_p2(peep2)) * self._activation(j))
-    else:
-      c = sigmoid(f + self._forget_bias) * c_prev + sigmoid(i) * self._activation(j)
-    if self._ln_c is None:
-      self._ln_c = Layer_Normalization([self._num_units], scope='c_norm')
-    c = self._ln_c(c)
-    if self._use_peepholes:
-      m = sigmoid(o + self._w_o_diag * c) * self._activation(c)
-    else:
-      m = sigmoid(o) * self._activation(c)
 
-    if self._num_proj is not None:
-      if self._linear is None:
-        scope = vs.get_variable_scope(scope)
-        with vs.variable_scope(scope, initializer=self._initializer):
-          with vs.variable_scope("projection") as proj_scope:
-            self._linear2 = _Linear(m, self._num_proj, False)
-      m = self._linear2(m)
-      if self._proj_clip is not None:
-        m = clip_ops.clip_by_value(m, -self._proj_clip, self._proj_clip)
-    hyper_c, hyper_h = new_hyper_state
-    new_state = LSTMStateTuple(tf.concat([c,hyper_c],1),tf.concat([m,hyper_h],1))
-    return m, new_state
+def fused_dynamic_rnn(cell, inputs, initial_state=None, dtype=None,
+                      time_major=False, scope=None):
+  """`dynamic_rnn` over full length sequences, fusing vanilla `LSTMCell`s.
+
+  If `cell` is an `LSTMCell` without peepholes, projection, cell clipping or
+  sharding and with the default `tanh` activation, the whole sequence is run
+  by a single `cudnn_lstm` call instead of a `while_loop` over `cell.call`.
+  The cell is built under `scope` exactly as `dynamic_rnn` would build it, if
+  it is not built yet, and the cuDNN parameters are converted from its own
+  `kernel`, `bias` and `recurrent_bias` variables, so checkpoints are
+  interchangeable between both paths.  Any other cell falls back to
+  `dynamic_rnn`.
 
+  `cudnn_lstm` only has a GPU kernel, so the fused path must be placed on a
+  GPU; on a CPU-only host use `dynamic_rnn` instead.
 
-class _Linear(object):
-  """Linear map: sum_i(args[i] * W[i]), where W[i] is a variable.
+  Unlike `dynamic_rnn`, this does not accept a `sequence_length` argument:
+  every sequence is run for `max_time` steps and the returned state is the
+  one after the last step, so padded batches need `dynamic_rnn` (or
+  `rnn_utils.packed_dynamic_rnn`) instead.
 
   Args:
-    args: a 2D Tensor or a list of 2D, batch x n, Tensors.
-    output_size: int, second dimension of weight variable.
-    dtype: data type for variables.
-    build_bias: boolean, whether to build a bias variable.
-    bias_initializer: starting value to initialize the bias
-      (default is all zeros).
-    kernel_initializer: starting value to initialize the weight.
+    cell: An instance of RNNCell.
+    inputs: The RNN inputs, `[batch_size, max_time, ...]` or, if `time_major`
+      is True, `[max_time, batch_size, ...]`.
+    initial_state: (optional) An initial state for the RNN.
+    dtype: (optional) The data type for the initial state.  Required if
+      `initial_state` is not provided.
+    time_major: The shape format of the `inputs` and `outputs` Tensors.
+    scope: VariableScope for the created subgraph; defaults to "rnn".
+
+  Returns:
+    A pair (outputs, state), as returned by `dynamic_rnn`.
 
   Raises:
-    ValueError: if inputs_shape is wrong.
+    ValueError: If input size cannot be inferred from inputs via
+      static shape inference.
   """
-
-  def __init__(self,
-               args,
-                     output_size,
-               build_bias,
-               bias_initializer=None,
-               kernel_initializer=None):
-    self._build_bias = build_bias
-
-    if args is None or (nest.is_sequence(args) and not args):
-      raise ValueError("`args` must be specified")
-    if not nest.is_sequence(args):
-      args = [args]
-      self._is_sequence = False
+  # pylint: disable=protected-access
+  if not (isinstance(cell, LSTMCell) and cell._cudnn_compatible):
+    return tf.nn.dynamic_rnn(cell, inputs, initial_state=initial_state,
+                             dtype=dtype, time_major=time_major, scope=scope)
+  num_units = cell._num_units
+
+  with vs.variable_scope(scope or "rnn"):
+    if not time_major:
+      inputs = array_ops.transpose(inputs, [1, 0, 2])
+    input_size = inputs.get_shape().with_rank(3)[2]
+    if input_size.value is None:
+      raise ValueError("Could not infer input size from inputs.get_shape()[-1]")
+    if initial_state is None:
+      initial_state = cell.zero_state(array_ops.shape(inputs)[1],
+                                      dtype or inputs.dtype)
+    if not cell.built:
+      # Build through the cell's own __call__, so the variables get the same
+      # scope and the same owner as under dynamic_rnn.  The step's outputs
+      # are never fetched, so it costs graph size only.
+      cell(inputs[0], initial_state)
+    if cell._state_is_tuple:
+      (c_prev, m_prev) = initial_state
     else:
-      self._is_sequence = True
-
-    # Calculate the total size of arguments on dimension 1.
-    total_arg_size = 0
-    shapes = [a.get_shape() for a in args]
-    for shape in shapes:
-      if shape.ndims != 2:
-        raise ValueError("linear is expecting 2D arguments: %s" % shapes)
-      if shape[1].value is None:
-        raise ValueError("linear expects shape[1] to be provided for shape %s, "
-                         "but saw %s" % (shape, shape[1]))
-      else:
-        total_arg_size += shape[1].value
+      c_prev, m_prev = array_ops.split(initial_state, 2, axis=1)
 
-    dtype = [a.dtype for a in args][0]
+    converter = cudnn_rnn_ops.CudnnParamsFormatConverterLSTM(
+        1, num_units, input_size.value)
+    params = converter.tf_canonical_to_opaque([cell._kernel, cell._gate_bias])
+    outputs, m, c = cudnn_rnn_ops.cudnn_lstm(
+        inputs, array_ops.expand_dims(m_prev, 0),
+        array_ops.expand_dims(c_prev, 0), params, is_training=True)
 
-    scope = vs.get_variable_scope()
-    with vs.variable_scope(scope) as outer_scope:
-      self._weights = vs.get_variable(
-          _WEIGHTS_VARIABLE_NAME, [total_arg_size, output_size],
-          dtype=dtype,
-          initializer=kernel_initializer)
-      if build_bias:
-        with vs.variable_scope(outer_scope) as inner_scope:
-          inner_scope.set_partitioner(None)
-          if bias_initializer is None:
-            bias_initializer = init_ops.constant_initializer(0.0, dtype=dtype)
-          self._biases = vs.get_variable(
-              _BIAS_VARIABLE_NAME, [output_size],
-              dtype=dtype,
-              initializer=bias_initializer)
-
-  def __call__(self, args):
-    if not self._is_sequence:
-      args = [args]
-
-    if len(args) == 1:
-      res = math_ops.matmul(args[0], self._weights)
-    else:
-      res = math_ops.matmul(array_ops.concat(args, 1), self._weights)
-    if self._build_bias:
-      res = nn_ops.bias_add(res, self._biases)
-    return res
+    if not time_major:
+      outputs = array_ops.transpose(outputs, [1, 0, 2])
+    c, m = c[0], m[0]
+    state = (LSTMStateTuple(c, m) if cell._state_is_tuple else
+             array_ops.concat([c, m], 1))
+  # pylint: enable=protected-access
+  return outputs, state
 
 
 
@@ -1007,12 +1311,18 @@ if __name__ == '__main__':
   c = tf.get_variable('c',[3,15])
   m = tf.get_variable('m',[3,15])
   i = tf.get_variable('i',[3,15])
-  t = LSTMStateTuple(c,m)
+  # (main, hyper) state pair for num_units=10, hyper_num_units=5
+  t = (LSTMStateTuple(c[:, :10], m[:, :10]), LSTMStateTuple(c[:, 10:], m[:, 10:]))
   with vs.variable_scope('c2') as scope:
     cell2 = H_LSTMCell(10, use_peepholes=True, hyper_num_units=5)
     o2 = cell2(i,t)
   sess = tf.Session()
   sess.run(tf.global_variables_initializer())
+  # odd hyper_num_units: the x and h scale embeddings start at w=0, b=1 and the bias embeddings at gaussian w, no bias
+  e = 4*16
+  w_z, b_z = sess.run([cell2._hyper_wb._w_z, cell2._hyper_wb._b_z])
+  assert w_z.shape == (5, 3*e) and not w_z[:, :2*e].any() and w_z[:, 2*e:].all()
+  assert b_z.shape == (2*e,) and (b_z == 1.0).all()
   a1,a2,a3 = sess.run([o2,t,i])
   print(a1)
   print('____________')
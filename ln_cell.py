@@ -27,7 +27,10 @@ from __future__ import print_function
 import collections
 import hashlib
 import numbers
+import weakref
 
+from tensorflow.contrib.compiler import jit
+from tensorflow.contrib.cudnn_rnn.python.ops import cudnn_rnn_ops
 from tensorflow.python.eager import context
 from tensorflow.python.framework import constant_op
 from tensorflow.python.framework import dtypes
@@ -37,11 +40,13 @@ from tensorflow.python.framework import tensor_util
 from tensorflow.python.layers import base as base_layer
 from tensorflow.python.ops import array_ops
 from tensorflow.python.ops import clip_ops
+from tensorflow.python.ops import control_flow_ops
 from tensorflow.python.ops import init_ops
 from tensorflow.python.ops import math_ops
 from tensorflow.python.ops import nn_ops
 from tensorflow.python.ops import partitioned_variables
 from tensorflow.python.ops import random_ops
+from tensorflow.python.ops import state_ops
 from tensorflow.python.ops import tensor_array_ops
 from tensorflow.python.ops import variable_scope as vs
 from tensorflow.python.ops import variables as tf_variables
@@ -51,6 +56,9 @@ import tensorflow as tf
 
 _BIAS_VARIABLE_NAME = "bias"
 _WEIGHTS_VARIABLE_NAME = "kernel"
+_RECURRENT_BIAS_VARIABLE_NAME = "recurrent_bias"
+# Gradient registry keys are global, h_cell carries its own copy of this code.
+_NN_MATMUL_GRAD = "NNMatMulGrad_" + __name__
 
 
 def _like_rnncell(cell):
@@ -82,6 +90,12 @@ def _concat(prefix, suffix, static=False):
     ValueError: if prefix or suffix was `None` and asked for dynamic
       Tensors out.
   """
+  # Common case from zero_state: an int batch size and an int state size.
+  if (isinstance(prefix, numbers.Integral) and
+      isinstance(suffix, numbers.Integral)):
+    if static:
+      return [prefix, suffix]
+    return constant_op.constant([prefix, suffix], dtype=dtypes.int32)
   if isinstance(prefix, ops.Tensor):
     p = prefix
     p_static = tensor_util.constant_value(prefix)
@@ -133,6 +147,94 @@ def _zero_state_tensors(state_size, batch_size, dtype):
   return nest.map_structure(get_state_shape, state_size)
 
 
+def _lstm_bias_initializer(num_units, forget_bias):
+  """Returns an initializer for an `[i, j, f, o]` gate bias of `4 * num_units`.
+
+  The `f` slice starts at `forget_bias` and the other gates at zero, so the
+  forget bias costs nothing at run time.
+  """
+  def _initializer(shape, dtype=dtypes.float32, partition_info=None):
+    del shape, partition_info  # Unused.
+    return constant_op.constant(
+        [0.0] * (2 * num_units) + [forget_bias] * num_units +
+        [0.0] * num_units, dtype=dtype)
+  return _initializer
+
+
+def _outside_control_flow(fn):
+  """Calls `fn` with no control flow context and no control dependencies.
+
+  Ops built by `fn` run once per `Session.run`, even if the caller is inside
+  the body of a `while_loop`; reading their results from the loop adds an
+  `Enter` op only.
+  """
+  graph = ops.get_default_graph()
+  # pylint: disable=protected-access
+  outer_context = graph._get_control_flow_context()
+  graph._set_control_flow_context(None)
+  try:
+    with ops.control_dependencies(None):
+      return fn()
+  finally:
+    graph._set_control_flow_context(outer_context)
+  # pylint: enable=protected-access
+
+
+@ops.RegisterGradient(_NN_MATMUL_GRAD)
+def _nn_matmul_grad(op, grad):
+  """Gradient of an untransposed MatMul with the transposes made explicit.
+
+  The stock gradient issues `grad * kernel^T` and `x^T * grad` as transposed
+  GEMMs, which cuBLAS runs noticeably slower than the plain `NN` form.
+  A kernel entered into a `while_loop` unchanged is transposed once per run,
+  outside the loop, instead of on every backward step.
+  """
+  x, kernel = op.inputs
+  source = kernel
+  while (source.op.type in ("Enter", "RefEnter") and
+         source.op.get_attr("is_constant")):
+    source = source.op.inputs[0]
+  # pylint: disable=protected-access
+  if (source is not kernel and
+      source.op._get_control_flow_context() is None):
+    kernel_t = _outside_control_flow(lambda: array_ops.transpose(source))
+  else:
+    kernel_t = array_ops.transpose(kernel)
+  # pylint: enable=protected-access
+  return (math_ops.matmul(grad, kernel_t),
+          math_ops.matmul(array_ops.transpose(x), grad))
+
+
+def _fused_linear(x, kernel, bias=None, compute_dtype=None):
+  """`x * kernel + bias` for variables owned by the calling cell.
+
+  Args:
+    x: 2D Tensor, batch x n.
+    kernel: 2D weight, n x output_size.
+    bias: (optional) 1D bias of output_size, added with a single `bias_add`.
+    compute_dtype: (optional) dtype to run the matmul in, the result is cast
+      back to `x.dtype`.  `x` is cast on every call, `kernel` only if it is
+      not already of `compute_dtype`, so a kernel cast once outside the
+      `while_loop` is read as is.
+
+  Returns:
+    A 2D Tensor, batch x output_size, of `x.dtype`.  Its backward pass uses
+    `_nn_matmul_grad`.
+  """
+  with ops.get_default_graph().gradient_override_map(
+      {"MatMul": _NN_MATMUL_GRAD}):
+    if compute_dtype is None:
+      res = math_ops.matmul(x, kernel)
+    else:
+      if kernel.dtype.base_dtype != compute_dtype:
+        kernel = math_ops.cast(kernel, compute_dtype)
+      res = math_ops.cast(
+          math_ops.matmul(math_ops.cast(x, compute_dtype), kernel), x.dtype)
+  if bias is not None:
+    res = nn_ops.bias_add(res, bias)
+  return res
+
+
 class RNNCell(base_layer.Layer):
   """Abstract object representing an RNN cell.
 
@@ -182,17 +284,30 @@ class RNNCell(base_layer.Layer):
                              custom_getter=self._rnn_get_variable):
         return super(RNNCell, self).__call__(inputs, state)
 
+  def __init__(self, *args, **kwargs):
+    super(RNNCell, self).__init__(*args, **kwargs)
+    # Variables already filed by _rnn_get_variable, for O(1) lookups.
+    self._rnn_variables = set()
+    # zero_state results for static batch sizes of one graph, see zero_state.
+    self._zero_state_graph = None
+    self._zero_state_cache = {}
+
   def _rnn_get_variable(self, getter, *args, **kwargs):
     variable = getter(*args, **kwargs)
-    if context.in_graph_mode():
-      trainable = (variable in tf_variables.trainable_variables() or
-                   (isinstance(variable, tf_variables.PartitionedVariable) and
-                    list(variable)[0] in tf_variables.trainable_variables()))
-    else:
-      trainable = variable._trainable  # pylint: disable=protected-access
-    if trainable and variable not in self._trainable_weights:
+    if variable in self._rnn_variables:
+      return variable
+    self._rnn_variables.add(variable)
+    first = (list(variable)[0]
+             if isinstance(variable, tf_variables.PartitionedVariable)
+             else variable)
+    # Read the flag off the variable instead of scanning the global
+    # trainable collection, which made building a large model quadratic.
+    trainable = getattr(first, "trainable", getattr(first, "_trainable", None))
+    if trainable is None:
+      trainable = first in tf_variables.trainable_variables()
+    if trainable:
       self._trainable_weights.append(variable)
-    elif not trainable and variable not in self._non_trainable_weights:
+    else:
       self._non_trainable_weights.append(variable)
     return variable
 
@@ -230,9 +345,40 @@ class RNNCell(base_layer.Layer):
       a nested list or tuple (of the same structure) of `2-D` tensors with
       the shapes `[batch_size x s]` for each s in `state_size`.
     """
+    state_size = self.state_size
+    # Zero tensors are immutable, so a static batch size can share one set of
+    # them per control flow context and device instead of new ops per call.
+    cache_key = None
+    graph = ops.get_default_graph()
+    # Zeros cached outside a control_dependencies block would silently drop
+    # its dependencies, so calls inside one always build new ops.
+    # pylint: disable=protected-access
+    control_deps = graph._control_dependencies_stack
+    # pylint: enable=protected-access
+    if isinstance(batch_size, numbers.Integral) and not control_deps:
+      if (self._zero_state_graph is None or
+          self._zero_state_graph() is not graph):
+        # Only the graph being built is cached, so a cell used across graphs
+        # does not keep all of them alive.
+        self._zero_state_graph = weakref.ref(graph)
+        self._zero_state_cache = {}
+      # The device stack keeps towers of a cell shared across tf.device
+      # scopes from reading another tower's zeros.  It holds the device
+      # functions themselves and every tf.device block pushes a new one, so
+      # zeros are only shared between calls in the same tf.device block (or
+      # outside of any); each block builds its own, as without the cache.
+      # pylint: disable=protected-access
+      cache_key = (graph._get_control_flow_context(),
+                   tuple(graph._device_function_stack), batch_size,
+                   dtypes.as_dtype(dtype))
+      # pylint: enable=protected-access
+      if cache_key in self._zero_state_cache:
+        return self._zero_state_cache[cache_key]
     with ops.name_scope(type(self).__name__ + "ZeroState", values=[batch_size]):
-      state_size = self.state_size
-      return _zero_state_tensors(state_size, batch_size, dtype)
+      zeros = _zero_state_tensors(state_size, batch_size, dtype)
+    if cache_key is not None:
+      self._zero_state_cache[cache_key] = zeros
+    return zeros
 
 
 _LSTMStateTuple = collections.namedtuple("LSTMStateTuple", ("c", "h"))
@@ -285,7 +431,7 @@ class LSTMCell(RNNCell):
                initializer=None, num_proj=None, proj_clip=None,
                num_unit_shards=None, num_proj_shards=None,
                forget_bias=1.0, state_is_tuple=True,
-               activation=None, reuse=None):
+               activation=None, reuse=None, compute_dtype=None):
     """Initialize the parameters for an LSTM cell.
 
     Args:
@@ -306,8 +452,10 @@ class LSTMCell(RNNCell):
         Use a variable_scope partitioner instead.
       forget_bias: Biases of the forget gate are initialized by default to 1
         in order to reduce the scale of forgetting at the beginning of
-        the training. Must set it manually to `0.0` when restoring from
-        CudnnLSTM trained checkpoints.
+        the training.  It is only used to initialize the `f` slice of the
+        bias, so CudnnLSTM trained checkpoints can be restored as is.  Like
+        cuDNN, the cell keeps separate input (`bias`) and recurrent
+        (`recurrent_bias`) gate biases and adds them up before use.
       state_is_tuple: If True, accepted and returned states are 2-tuples of
         the `c_state` and `m_state`.  If False, they are concatenated
         along the column axis.  This latter behavior will soon be deprecated.
@@ -315,9 +463,20 @@ class LSTMCell(RNNCell):
       reuse: (optional) Python boolean describing whether to reuse variables
         in an existing scope.  If not `True`, and the existing scope already has
         the given variables, an error is raised.
+      compute_dtype: (optional) `tf.float16` or `tf.bfloat16`.  If set, the
+        gate matmul runs in this dtype so it can use Tensor Cores.  Variables
+        stay in the input dtype as master copies; the kernel is cast to
+        `compute_dtype` once per run, outside the time loop, and every step
+        reads that copy.  The gate and cell state math stays in the input
+        dtype.  `num_units` must then be a multiple of 8.
+
+      To restore CudnnLSTM-trained opaque params, build the cell and run
+      `load_cudnn_checkpoint`.  To run a vanilla cell over whole sequences in
+      a single cuDNN kernel, use `fused_dynamic_rnn`.
 
-      When restoring from CudnnLSTM-trained checkpoints, must use
-      CudnnCompatibleLSTMCell instead.
+    Raises:
+      ValueError: If `compute_dtype` is set and `num_units` is not a multiple
+        of 8.
     """
     super(LSTMCell, self).__init__(_reuse=reuse)
     if not state_is_tuple:
@@ -328,6 +487,12 @@ class LSTMCell(RNNCell):
           "%s: The num_unit_shards and proj_unit_shards parameters are "
           "deprecated and will be removed in Jan 2017.  "
           "Use a variable scope with a partitioner instead.", self)
+    if compute_dtype is not None:
+      compute_dtype = dtypes.as_dtype(compute_dtype)
+      if num_units % 8:
+        raise ValueError("num_units must be a multiple of 8 to use Tensor "
+                         "Cores with compute_dtype %s, got %d."
+                         % (compute_dtype.name, num_units))
 
     self._num_units = num_units
     self._use_peepholes = use_peepholes
@@ -340,6 +505,7 @@ class LSTMCell(RNNCell):
     self._forget_bias = forget_bias
     self._state_is_tuple = state_is_tuple
     self._activation = activation or math_ops.tanh
+    self._compute_dtype = compute_dtype
 
     if num_proj:
       self._state_size = (
@@ -351,12 +517,15 @@ class LSTMCell(RNNCell):
           LSTMStateTuple(num_units, num_units)
           if state_is_tuple else 2 * num_units)
       self._output_size = num_units
-    self._linear1 = None
-    self._linear2 = None
-    if self._use_peepholes:
-      self._w_f_diag = None
-      self._w_i_diag = None
-      self._w_o_diag = None
+    self._kernel = None
+    self._bias = None
+    self._recurrent_bias = None
+    self._folded_gate_bias = None
+    self._compute_kernel = None
+    self._proj_kernel = None
+    self._w_f_diag = None
+    self._w_i_diag = None
+    self._w_o_diag = None
 
   @property
   def state_size(self):
@@ -366,6 +535,133 @@ class LSTMCell(RNNCell):
   def output_size(self):
     return self._output_size
 
+  @property
+  def _gate_bias(self):
+    """The `[4 * num_units]` gate bias, input plus recurrent bias."""
+    if self._folded_gate_bias is not None:
+      return self._folded_gate_bias
+    return self._bias + self._recurrent_bias
+
+  @property
+  def _gate_kernel(self):
+    """The gate kernel, cast to `compute_dtype` once per run if that is set."""
+    if self._compute_kernel is not None:
+      return self._compute_kernel
+    return self._kernel
+
+  @property
+  def _cudnn_compatible(self):
+    """Whether this cell computes exactly what a cuDNN LSTM layer computes."""
+    return (not self._use_peepholes and self._num_proj is None and
+            self._cell_clip is None and self._num_unit_shards is None and
+            self._compute_dtype is None and self._activation is math_ops.tanh)
+
+  def load_cudnn_checkpoint(self, params):
+    """Returns an op assigning cuDNN opaque `params` to this cell's variables.
+
+    `params` must come from a single layer, unidirectional CudnnLSTM with the
+    same `num_units` and input size, e.g. a restored `CudnnLSTM` layer's
+    opaque params.  The eight cuDNN weight matrices and bias vectors are
+    reordered from cuDNN's `[i, f, c, o]` gate order to `[i, j, f, o]`; the
+    input and recurrent biases land in `bias` and `recurrent_bias`
+    unchanged.
+
+    Args:
+      params: 1D opaque cuDNN parameter buffer.
+
+    Returns:
+      An op that performs the assignment.
+
+    Raises:
+      ValueError: If the cell is not built yet, or does not compute the same
+        function as a cuDNN LSTM.
+    """
+    if not self.built:
+      raise ValueError("%s must be built before loading cuDNN params." % self)
+    if not self._cudnn_compatible:
+      raise ValueError("%s has no cuDNN equivalent." % self)
+    n = self._num_units
+    weights, biases = cudnn_rnn_ops.cudnn_rnn_opaque_params_to_canonical(
+        "lstm", 1, n, self._input_size, params)
+    w_i, w_f, w_c, w_o = [array_ops.reshape(w, [n, self._input_size])
+                          for w in weights[:4]]
+    r_i, r_f, r_c, r_o = [array_ops.reshape(r, [n, n]) for r in weights[4:]]
+    b_wi, b_wf, b_wc, b_wo, b_ri, b_rf, b_rc, b_ro = biases
+    kernel = array_ops.concat(
+        [array_ops.transpose(array_ops.concat([w, r], 1))
+         for w, r in ((w_i, r_i), (w_c, r_c), (w_f, r_f), (w_o, r_o))], 1)
+    return control_flow_ops.group(
+        state_ops.assign(self._kernel, kernel),
+        state_ops.assign(self._bias,
+                         array_ops.concat([b_wi, b_wc, b_wf, b_wo], 0)),
+        state_ops.assign(self._recurrent_bias,
+                         array_ops.concat([b_ri, b_rc, b_rf, b_ro], 0)))
+
+  def build(self, inputs_shape):
+    """Create the gate kernel, bias, peephole and projection variables once.
+
+    Args:
+      inputs_shape: TensorShape of the `inputs` of the first call.
+
+    Raises:
+      ValueError: If input size cannot be inferred from inputs via
+        static shape inference.
+    """
+    input_size = inputs_shape.with_rank(2)[1]
+    if input_size.value is None:
+      raise ValueError("Could not infer input size from inputs.get_shape()[-1]")
+    self._input_size = input_size.value
+    num_proj = self._num_units if self._num_proj is None else self._num_proj
+    dtype = self.dtype
+
+    scope = vs.get_variable_scope()
+    with vs.variable_scope(
+        scope, initializer=self._initializer) as unit_scope:
+      if self._num_unit_shards is not None:
+        unit_scope.set_partitioner(
+            partitioned_variables.fixed_size_partitioner(
+                self._num_unit_shards))
+      self._kernel = vs.get_variable(
+          _WEIGHTS_VARIABLE_NAME,
+          [self._input_size + num_proj, 4 * self._num_units], dtype=dtype)
+      with vs.variable_scope(unit_scope) as inner_scope:
+        inner_scope.set_partitioner(None)
+        self._bias = vs.get_variable(
+            _BIAS_VARIABLE_NAME, [4 * self._num_units], dtype=dtype,
+            initializer=_lstm_bias_initializer(self._num_units,
+                                               self._forget_bias))
+        self._recurrent_bias = vs.get_variable(
+            _RECURRENT_BIAS_VARIABLE_NAME, [4 * self._num_units], dtype=dtype,
+            initializer=init_ops.zeros_initializer())
+        # Diagonal connections
+        if self._use_peepholes:
+          self._w_f_diag = vs.get_variable(
+              "w_f_diag", shape=[self._num_units], dtype=dtype)
+          self._w_i_diag = vs.get_variable(
+              "w_i_diag", shape=[self._num_units], dtype=dtype)
+          self._w_o_diag = vs.get_variable(
+              "w_o_diag", shape=[self._num_units], dtype=dtype)
+        if self._num_proj is not None:
+          with vs.variable_scope("projection") as proj_scope:
+            if self._num_proj_shards is not None:
+              proj_scope.set_partitioner(
+                  partitioned_variables.fixed_size_partitioner(
+                      self._num_proj_shards))
+            self._proj_kernel = vs.get_variable(
+                _WEIGHTS_VARIABLE_NAME, [self._num_units, self._num_proj],
+                dtype=dtype)
+    if context.in_graph_mode():
+      # Add the biases up once per run, not on every step of the while_loop
+      # the first call is usually built in.
+      self._folded_gate_bias = _outside_control_flow(
+          lambda: self._bias + self._recurrent_bias)
+      if self._compute_dtype is not None:
+        # Likewise one reduced precision copy of the kernel per run, instead
+        # of reading the master copy and writing a new copy on every step.
+        self._compute_kernel = _outside_control_flow(
+            lambda: math_ops.cast(self._kernel, self._compute_dtype))
+    self.built = True
+
   def call(self, inputs, state):
     """Run one step of LSTM.
 
@@ -386,79 +682,51 @@ class LSTMCell(RNNCell):
            num_units otherwise.
       - Tensor(s) representing the new state of LSTM after reading `inputs` when
         the previous state was `state`.  Same type and shape(s) as `state`.
-
-    Raises:
-      ValueError: If input size cannot be inferred from inputs via
-        static shape inference.
     """
     num_proj = self._num_units if self._num_proj is None else self._num_proj
     sigmoid = math_ops.sigmoid
+    activation = self._activation
 
     if self._state_is_tuple:
       (c_prev, m_prev) = state
     else:
-      c_prev = array_ops.slice(state, [0, 0], [-1, self._num_units])
-      m_prev = array_ops.slice(state, [0, self._num_units], [-1, num_proj])
-
-    dtype = inputs.dtype
-    input_size = inputs.get_shape().with_rank(2)[1]
-    if input_size.value is None:
-      raise ValueError("Could not infer input size from inputs.get_shape()[-1]")
-    if self._linear1 is None:
-      scope = vs.get_variable_scope()
-      with vs.variable_scope(
-          scope, initializer=self._initializer) as unit_scope:
-        if self._num_unit_shards is not None:
-          unit_scope.set_partitioner(
-              partitioned_variables.fixed_size_partitioner(
-                  self._num_unit_shards))
-        self._linear1 = _Linear([inputs, m_prev], 4 * self._num_units, True)
+      c_prev, m_prev = array_ops.split(state, [self._num_units, num_proj],
+                                       axis=1)
 
     # i = input_gate, j = new_input, f = forget_gate, o = output_gate
-    lstm_matrix = self._linear1([inputs, m_prev])
-    i, j, f, o = array_ops.split(
-        value=lstm_matrix, num_or_size_splits=4, axis=1)
-    # Diagonal connections
-    if self._use_peepholes and not self._w_f_diag:
-      scope = vs.get_variable_scope()
-      with vs.variable_scope(
-          scope, initializer=self._initializer) as unit_scope:
-        with vs.variable_scope(unit_scope):
-          self._w_f_diag = vs.get_variable(
-              "w_f_diag", shape=[self._num_units], dtype=dtype)
-          self._w_i_diag = vs.get_variable(
-              "w_i_diag", shape=[self._num_units], dtype=dtype)
-          self._w_o_diag = vs.get_variable(
-              "w_o_diag", shape=[self._num_units], dtype=dtype)
+    # One [batch, input_size + num_proj] x [input_size + num_proj, 4 * units]
+    # GEMM over the concatenated input and recurrent state.
+    xh = array_ops.concat([inputs, m_prev], 1)
+    lstm_matrix = _fused_linear(xh, self._gate_kernel, self._gate_bias,
+                                self._compute_dtype)
+    # Everything between the gate matmul and the projection is pointwise, so
+    # let XLA fuse it into a single kernel.  No variables may be created here.
+    with jit.experimental_jit_scope():
+      # Column slices, the forget bias is already part of the gate bias.
+      n = self._num_units
+      i = lstm_matrix[:, :n]
+      j = lstm_matrix[:, n:2 * n]
+      f = lstm_matrix[:, 2 * n:3 * n]
+      o = lstm_matrix[:, 3 * n:]
+
+      if self._use_peepholes:
+        c = (sigmoid(f + self._w_f_diag * c_prev) * c_prev +
+             sigmoid(i + self._w_i_diag * c_prev) * activation(j))
+      else:
+        c = sigmoid(f) * c_prev + sigmoid(i) * activation(j)
 
-    if self._use_peepholes:
-      c = (sigmoid(f + self._forget_bias + self._w_f_diag * c_prev) * c_prev +
-           sigmoid(i + self._w_i_diag * c_prev) * self._activation(j))
-    else:
-      c = (sigmoid(f + self._forget_bias) * c_prev + sigmoid(i) *
-           self._activation(j))
+      if self._cell_clip is not None:
+        # pylint: disable=invalid-unary-operand-type
+        c = clip_ops.clip_by_value(c, -self._cell_clip, self._cell_clip)
+        # pylint: enable=invalid-unary-operand-type
 
-    if self._cell_clip is not None:
-      # pylint: disable=invalid-unary-operand-type
-      c = clip_ops.clip_by_value(c, -self._cell_clip, self._cell_clip)
-      # pylint: enable=invalid-unary-operand-type
-    
-    if self._use_peepholes:
-      m = sigmoid(o + self._w_o_diag * c) * self._activation(c)
-    else:
-      m = sigmoid(o) * self._activation(c)
+      if self._use_peepholes:
+        m = sigmoid(o + self._w_o_diag * c) * activation(c)
+      else:
+        m = sigmoid(o) * activation(c)
 
     if self._num_proj is not None:
-      if self._linear2 is None:
-        scope = vs.get_variable_scope()
-        with vs.variable_scope(scope, initializer=self._initializer):
-          with vs.variable_scope("projection") as proj_scope:
-            if self._num_proj_shards is not None:
-              proj_scope.set_partitioner(
-                  partitioned_variables.fixed_size_partitioner(
-                      self._num_proj_shards))
-            self._linear2 = _Linear(m, self._num_proj, False)
-      m = self._linear2(m)
+      m = _fused_linear(m, self._proj_kernel)
 
       if self._proj_clip is not None:
         # pylint: disable=invalid-unary-operand-type
@@ -524,19 +792,16 @@ class LN_LSTMCell(RNNCell):
       self._state_size = (LSTMStateTuple(num_units, num_units) if state_is_tuple else num_units + num_units)
       self._output_size = num_units
 
-    self._linear1 = None
-    self._linear2 = None
-    if self._use_peepholes:
-      self._w_f_diag = None
-      self._w_i_diag = None
-      self._w_o_diag = None
-    self._ln_i = None
-    self._ln_j = None
-    self._ln_f = None
-    self._ln_o = None
-    if self._use_peepholes:
-      self._ln_p1 = None
-      self._ln_p2 = None
+    self._kernel = None
+    self._bias = None
+    self._proj_kernel = None
+    # all set by build(), the peephole ones only if use_peepholes
+    self._w_f_diag = None
+    self._w_i_diag = None
+    self._w_o_diag = None
+    self._ln_gates = None
+    self._ln_p1 = None
+    self._ln_p2 = None
     self._ln_c = None
 
   @property
@@ -547,6 +812,39 @@ class LN_LSTMCell(RNNCell):
     return self._output_size
   
 
+  def build(self, inputs_shape):
+    """
+      Create kernel, bias, peephole, projection and layer normalization variables once, before the first step.
+
+      Args:
+        inputs_shape: TensorShape of the 'inputs' of the first call.
+    """
+    input_size = inputs_shape.with_rank(2)[1]
+    if input_size.value is None:
+      raise ValueError('Could not infer input size from inputs.get_shape()[-1]')
+    self._input_size = input_size.value
+    num_proj = self._num_units if self._num_proj is None else self._num_proj
+    dtype = self.dtype
+
+    scope = vs.get_variable_scope()
+    with vs.variable_scope(scope, initializer=self._initializer):
+      self._kernel = vs.get_variable(_WEIGHTS_VARIABLE_NAME, [self._input_size + num_proj, 4 * self._num_units], dtype=dtype)
+      self._bias = vs.get_variable(_BIAS_VARIABLE_NAME, [4 * self._num_units], dtype=dtype, initializer=init_ops.constant_initializer(0.0, dtype=dtype))
+      # diagonal connections
+      if self._use_peepholes:
+        self._w_f_diag = vs.get_variable("w_f_diag", shape=[self._num_units], dtype=dtype)
+        self._w_i_diag = vs.get_variable("w_i_diag", shape=[self._num_units], dtype=dtype)
+        self._w_o_diag = vs.get_variable("w_o_diag", shape=[self._num_units], dtype=dtype)
+        self._ln_p1 = Layer_Normalization([self._num_units], scope='p1_norm')
+        self._ln_p2 = Layer_Normalization([self._num_units], scope='p2_norm')
+      if self._num_proj is not None:
+        with vs.variable_scope("projection"):
+          self._proj_kernel = vs.get_variable(_WEIGHTS_VARIABLE_NAME, [self._num_units, self._num_proj], dtype=dtype)
+    # one [4, num_units] gain/bias, normalized per gate over the last axis
+    self._ln_gates = Layer_Normalization([4, self._num_units], scope='ijfo_norm')
+    self._ln_c = Layer_Normalization([self._num_units], scope='c_norm')
+    self.built = True
+
   def call(self, inputs, state):
     """
       Run one step of cell,
@@ -557,75 +855,38 @@ class LN_LSTMCell(RNNCell):
     """
     num_proj = self._num_units if self._num_proj is None else self._num_proj
     sigmoid = math_ops.sigmoid
+    activation = self._activation
 
     if self._state_is_tuple:
       (c_prev, m_prev) = state
     else:
-      c_prev = array_ops.slice(state, [0, 0], [-1, self._num_units])
-      m_prev = array_ops.slice(state, [0, self._num_units] , [-1, num_proj])
-
-    dtype = inputs.dtype
-    input_size = inputs.get_shape().with_rank(2)[1]
-    if input_size.value is None:
-      raise ValueError('Could not infer input size from inputs.get_shape()[-1]')
-    if self._linear1 is None:
-      scope = vs.get_variable_scope()
-      with vs.variable_scope(scope, initializer=self._initializer) as unit_scope:
-        self._linear1 = _Linear([inputs, m_prev], 4 * self._num_units, True)
-    lstm_matrix = self._linear1([inputs, m_prev])
-    # i=input_gate, j=new_input, f=forget_gate, o=output_gate
-    i,j,f,o = array_ops.split(value=lstm_matrix, num_or_size_splits=4, axis=1)
-    if self._ln_i is None:
-      self._ln_i = Layer_Normalization([self._num_units], scope='i_norm')
-    if self._ln_j is None:
-      self._ln_j = Layer_Normalization([self._num_units], scope='j_norm')
-    if self._ln_f is None:
-      self._ln_f = Layer_Normalization([self._num_units], scope='f_norm')
-    if self._ln_o is None:
-      self._ln_o = Layer_Normalization([self._num_units], scope='o_norm')
-    i = self._ln_i(i)
-    j = self._ln_j(j)
-    f = self._ln_f(f)
-    o = self._ln_o(o)
-    
-    # diagonal connections
-    if self._use_peepholes and not self._w_f_diag:
-      scope = vs.get_variable_scope()
-      with vs.variable_scope(scope, initializer=self._initializer) as unit_scope:
-        with vs.variable_scope(unit_scope):
-          self._w_f_diag = vs.get_variable("w_f_diag", shape=[self._num_units], dtype=dtype)
-          self._w_i_diag = vs.get_variable("w_i_diag", shape=[self._num_units], dtype=dtype)
-          self._w_o_diag = vs.get_variable("w_o_diag", shape=[self._num_units], dtype=dtype)
-          if self._ln_p1 is None:
-            self._ln_p1 = Layer_Normalization([self._num_units], scope='p1_norm')
-          if self._ln_p2 is None:
-            self._ln_p2 = Layer_Normalization([self._num_units], scope='p2_norm')
-    if self._use_peepholes:
-      peep1 = self._w_f_diag * c_prev
-      #if self._ln_p1 is None:
-      #  self._ln_p1 = Layer_Normalization([self._num_units], scope='p1_norm')
-      peep2 = self._w_i_diag*c_prev
-      #if self._ln_p2 is None:
-      #  self._ln_p2 = Layer_Normalization([self._num_units], scope='p2_norm')
-      c = (sigmoid(f + self._forget_bias + self._ln_p1(peep1)) + sigmoid(i + self._ln_p2(peep2)) * self._activation(j))
-    else:
-      c = (sigmoid(f + self._forget_bias) * c_prev + sigmoid(i) * self._activation(j))
-    if self._ln_c is None:
-      self._ln_c = Layer_Normalization([self._num_units], scope='c_norm')
-    c = self._ln_c(c)
-    if self._use_peepholes:
-      m = sigmoid(o + self._w_o_diag * c) * self._activation(c)
-    else:
-      m = sigmoid(o) * self._activation(c)
+      c_prev, m_prev = array_ops.split(state, [self._num_units, num_proj], axis=1)
+
+    # single GEMM over the concatenated [inputs, m_prev]
+    xh = array_ops.concat([inputs, m_prev], 1)
+    lstm_matrix = _fused_linear(xh, self._kernel, self._bias)
+    # gate math up to the projection is pointwise plus small reductions, fuse it with XLA.
+    # all variables come from build(), none may be created in this scope.
+    with jit.experimental_jit_scope():
+      # i=input_gate, j=new_input, f=forget_gate, o=output_gate
+      # normalize all four gates with one reduction over [batch, 4, num_units]
+      gates = self._ln_gates(array_ops.reshape(lstm_matrix, [-1, 4, self._num_units]))
+      i, j, f, o = array_ops.unstack(gates, axis=1)
+
+      if self._use_peepholes:
+        peep1 = self._w_f_diag * c_prev
+        peep2 = self._w_i_diag*c_prev
+        c = (sigmoid(f + self._forget_bias + self._ln_p1(peep1)) * c_prev + sigmoid(i + self._ln_p2(peep2)) * activation(j))
+      else:
+        c = (sigmoid(f + self._forget_bias) * c_prev + sigmoid(i) * activation(j))
+      c = self._ln_c(c)
+      if self._use_peepholes:
+        m = sigmoid(o + self._w_o_diag * c) * activation(c)
+      else:
+        m = sigmoid(o) * activation(c)
 
     if self._num_proj is not None:
-      if self._linear2 is None:
-        scope = vs.get_variable_scope()
-        with vs.variable_scope(scope, initializer=self._initializer):
-          with vs.variable_scope("projection") as proj_scope:
-            self._linear2 = _Linear(m, self._num_proj, False)
-            
-      m = self._linear2(m)
+      m = _fused_linear(m, self._proj_kernel)
 
       if self._proj_clip is not None:
         m = clip_ops.clip_by_value(m, -self._proj_clip, self._proj_clip)
@@ -635,98 +896,113 @@ class LN_LSTMCell(RNNCell):
 
 
 class Layer_Normalization(object):
+  """
+    Layer normalization over the last axis of its inputs. 'dim' is the shape of the gain and bias,
+    e.g. [num_units] for [batch, num_units] inputs or [4, num_units] to normalize each of 4 gates
+    of a [batch, 4, num_units] tensor separately. 'dtype' is the storage type of gain and bias, they are cast
+    to the dtype of the inputs when applied.
+  """
 
-  def __init__(self, dim, scope="layer_normalization",  epsilon=1e-5):
+  def __init__(self, dim, scope="layer_normalization",  epsilon=1e-5, dtype=tf.float32):
     self._epsilon = epsilon
     with vs.variable_scope(scope) as var_scope:
-      self._g = vs.get_variable('gain',dim, initializer=tf.ones_initializer(), dtype=tf.float32)
-      self._b = vs.get_variable('bias',dim, initializer=tf.zeros_initializer(), dtype=tf.float32)
+      self._g = vs.get_variable('gain',dim, initializer=tf.ones_initializer(), dtype=dtype)
+      self._b = vs.get_variable('bias',dim, initializer=tf.zeros_initializer(), dtype=dtype)
 
   def __call__(self, inputs):
-      m, v = tf.nn.moments(inputs, [1], keep_dims=True)
-      norm_inputs = (inputs - m) / tf.sqrt(v + self._epsilon)
-      return norm_inputs * self._g + self._b
+    # moments, normalize and affine as one XLA cluster, so inputs is streamed once
+    with jit.experimental_jit_scope():
+      # E[x] and E[x^2] are independent reductions over one read of inputs,
+      # unlike tf.nn.moments which needs the mean before the second pass.
+      m = tf.reduce_mean(inputs, [-1], keep_dims=True)
+      v = tf.maximum(tf.reduce_mean(tf.square(inputs), [-1], keep_dims=True) - tf.square(m), 0.)
+      # normalize, scale and shift as inputs * a + (bias - m * a) with
+      # a = gain * rsqrt(v + eps), no division and no separate affine step.
+      g = tf.cast(self._g, inputs.dtype)
+      b = tf.cast(self._b, inputs.dtype)
+      return tf.nn.batch_normalization(inputs, m, v, b, g, self._epsilon)
     
 
 
 
 
+def fused_dynamic_rnn(cell, inputs, initial_state=None, dtype=None,
+                      time_major=False, scope=None):
+  """`dynamic_rnn` over full length sequences, fusing vanilla `LSTMCell`s.
 
+  If `cell` is an `LSTMCell` without peepholes, projection, cell clipping or
+  sharding and with the default `tanh` activation, the whole sequence is run
+  by a single `cudnn_lstm` call instead of a `while_loop` over `cell.call`.
+  The cell is built under `scope` exactly as `dynamic_rnn` would build it, if
+  it is not built yet, and the cuDNN parameters are converted from its own
+  `kernel`, `bias` and `recurrent_bias` variables, so checkpoints are
+  interchangeable between both paths.  Any other cell falls back to
+  `dynamic_rnn`.
 
+  `cudnn_lstm` only has a GPU kernel, so the fused path must be placed on a
+  GPU; on a CPU-only host use `dynamic_rnn` instead.
 
-class _Linear(object):
-  """Linear map: sum_i(args[i] * W[i]), where W[i] is a variable.
+  Unlike `dynamic_rnn`, this does not accept a `sequence_length` argument:
+  every sequence is run for `max_time` steps and the returned state is the
+  one after the last step, so padded batches need `dynamic_rnn` (or
+  `rnn_utils.packed_dynamic_rnn`) instead.
 
   Args:
-    args: a 2D Tensor or a list of 2D, batch x n, Tensors.
-    output_size: int, second dimension of weight variable.
-    dtype: data type for variables.
-    build_bias: boolean, whether to build a bias variable.
-    bias_initializer: starting value to initialize the bias
-      (default is all zeros).
-    kernel_initializer: starting value to initialize the weight.
+    cell: An instance of RNNCell.
+    inputs: The RNN inputs, `[batch_size, max_time, ...]` or, if `time_major`
+      is True, `[max_time, batch_size, ...]`.
+    initial_state: (optional) An initial state for the RNN.
+    dtype: (optional) The data type for the initial state.  Required if
+      `initial_state` is not provided.
+    time_major: The shape format of the `inputs` and `outputs` Tensors.
+    scope: VariableScope for the created subgraph; defaults to "rnn".
+
+  Returns:
+    A pair (outputs, state), as returned by `dynamic_rnn`.
 
   Raises:
-    ValueError: if inputs_shape is wrong.
+    ValueError: If input size cannot be inferred from inputs via
+      static shape inference.
   """
-
-  def __init__(self,
-               args,
-               output_size,
-               build_bias,
-               bias_initializer=None,
-               kernel_initializer=None):
-    self._build_bias = build_bias
-
-    if args is None or (nest.is_sequence(args) and not args):
-      raise ValueError("`args` must be specified")
-    if not nest.is_sequence(args):
-      args = [args]
-      self._is_sequence = False
-    else:
-      self._is_sequence = True
-
-    # Calculate the total size of arguments on dimension 1.
-    total_arg_size = 0
-    shapes = [a.get_shape() for a in args]
-    for shape in shapes:
-      if shape.ndims != 2:
-        raise ValueError("linear is expecting 2D arguments: %s" % shapes)
-      if shape[1].value is None:
-        raise ValueError("linear expects shape[1] to be provided for shape %s, "
-                         "but saw %s" % (shape, shape[1]))
-      else:
-        total_arg_size += shape[1].value
-
-    dtype = [a.dtype for a in args][0]
-
-    scope = vs.get_variable_scope()
-    with vs.variable_scope(scope) as outer_scope:
-      self._weights = vs.get_variable(
-          _WEIGHTS_VARIABLE_NAME, [total_arg_size, output_size],
-          dtype=dtype,
-          initializer=kernel_initializer)
-      if build_bias:
-        with vs.variable_scope(outer_scope) as inner_scope:
-          inner_scope.set_partitioner(None)
-          if bias_initializer is None:
-            bias_initializer = init_ops.constant_initializer(0.0, dtype=dtype)
-          self._biases = vs.get_variable(
-              _BIAS_VARIABLE_NAME, [output_size],
-              dtype=dtype,
-              initializer=bias_initializer)
-
-  def __call__(self, args):
-    if not self._is_sequence:
-      args = [args]
-
-    if len(args) == 1:
-      res = math_ops.matmul(args[0], self._weights)
+  # pylint: disable=protected-access
+  if not (isinstance(cell, LSTMCell) and cell._cudnn_compatible):
+    return tf.nn.dynamic_rnn(cell, inputs, initial_state=initial_state,
+                             dtype=dtype, time_major=time_major, scope=scope)
+  num_units = cell._num_units
+
+  with vs.variable_scope(scope or "rnn"):
+    if not time_major:
+      inputs = array_ops.transpose(inputs, [1, 0, 2])
+    input_size = inputs.get_shape().with_rank(3)[2]
+    if input_size.value is None:
+      raise ValueError("Could not infer input size from inputs.get_shape()[-1]")
+    if initial_state is None:
+      initial_state = cell.zero_state(array_ops.shape(inputs)[1],
+                                      dtype or inputs.dtype)
+    if not cell.built:
+      # Build through the cell's own __call__, so the variables get the same
+      # scope and the same owner as under dynamic_rnn.  The step's outputs
+      # are never fetched, so it costs graph size only.
+      cell(inputs[0], initial_state)
+    if cell._state_is_tuple:
+      (c_prev, m_prev) = initial_state
     else:
-      res = math_ops.matmul(array_ops.concat(args, 1), self._weights)
-    if self._build_bias:
-      res = nn_ops.bias_add(res, self._biases)
-    return res
+      c_prev, m_prev = array_ops.split(initial_state, 2, axis=1)
+
+    converter = cudnn_rnn_ops.CudnnParamsFormatConverterLSTM(
+        1, num_units, input_size.value)
+    params = converter.tf_canonical_to_opaque([cell._kernel, cell._gate_bias])
+    outputs, m, c = cudnn_rnn_ops.cudnn_lstm(
+        inputs, array_ops.expand_dims(m_prev, 0),
+        array_ops.expand_dims(c_prev, 0), params, is_training=True)
+
+    if not time_major:
+      outputs = array_ops.transpose(outputs, [1, 0, 2])
+    c, m = c[0], m[0]
+    state = (LSTMStateTuple(c, m) if cell._state_is_tuple else
+             array_ops.concat([c, m], 1))
+  # pylint: enable=protected-access
+  return outputs, state
 
 
 
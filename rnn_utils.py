@@ -0,0 +1,148 @@
+"""Drivers for running the cells in `ln_cell` and `h_cell` over padded batches.
+
+`dynamic_rnn` runs every row of a batch for `max_time` steps, so a batch with
+skewed sequence lengths spends most of its matmuls on padding.  The helpers
+here regroup the batch by length before handing it to `dynamic_rnn`, or, for
+step-by-step inference from Python, build the step graph once and re-run it.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from tensorflow.python.framework import dtypes
+from tensorflow.python.framework import tensor_shape
+from tensorflow.python.ops import array_ops
+from tensorflow.python.ops import math_ops
+from tensorflow.python.ops import nn_ops
+from tensorflow.python.ops import rnn
+from tensorflow.python.ops import variable_scope as vs
+from tensorflow.python.util import nest
+
+
+def packed_dynamic_rnn(cell, inputs, lengths, num_buckets=4,
+                       initial_state=None, dtype=None, scope=None):
+  """`dynamic_rnn` over a batch bucketed by sequence length.
+
+  The batch is sorted by decreasing length and cut into `num_buckets`
+  contiguous buckets of (nearly) equal size, delimited by cumulative row
+  offsets.  Each bucket is truncated to its own longest sequence and run by a
+  separate `dynamic_rnn`, which additionally stops early once every row of the
+  bucket has finished.  Outputs are zero-padded back to `max_time` and
+  scattered back into the original row order, so the result matches a single
+  `dynamic_rnn(cell, inputs, sequence_length=lengths)` call.
+
+  A batch with fewer than `num_buckets` rows, e.g. the last partial batch of
+  an epoch, is padded with empty sequences so that no bucket is empty; the
+  padding rows are dropped again from the results.
+
+  All buckets share the same cell and therefore the same variables.
+
+  Args:
+    cell: An instance of RNNCell.
+    inputs: The RNN inputs, `[batch_size, max_time, ...]`.
+    lengths: int32 Tensor of shape `[batch_size]`, the sequence lengths.
+    num_buckets: Python int, number of length buckets.
+    initial_state: (optional) An initial state for the RNN, in the original
+      row order.
+    dtype: (optional) The data type for the initial state.  Required if
+      `initial_state` is not provided.
+    scope: VariableScope for the created subgraph; defaults to "rnn".
+
+  Returns:
+    A pair (outputs, state), as returned by `dynamic_rnn`.
+
+  Raises:
+    ValueError: If `num_buckets` is not a positive integer.
+  """
+  if num_buckets < 1:
+    raise ValueError("num_buckets must be a positive integer, saw %d" %
+                     num_buckets)
+
+  with vs.variable_scope(scope or "rnn") as varscope:
+    batch_size = array_ops.shape(lengths)[0]
+    max_time = array_ops.shape(inputs)[1]
+    # Length 0 padding rows sort last and are cut off again below.
+    pad_rows = math_ops.maximum(num_buckets - batch_size, 0)
+    padded_size = batch_size + pad_rows
+    pad = lambda t: array_ops.pad(
+        t, [[0, pad_rows]] + [[0, 0]] * (t.get_shape().ndims - 1))
+    sorted_lengths, order = nn_ops.top_k(pad(lengths), k=padded_size)
+
+    def sort_rows(t):
+      # Pad with a Tensor amount loses the static shape, restore all but the
+      # batch dimension, e.g. the input size `cell.build` needs.
+      sorted_t = array_ops.gather(pad(t), order)
+      sorted_t.set_shape(
+          tensor_shape.TensorShape([None]).concatenate(t.get_shape()[1:]))
+      return sorted_t
+
+    sorted_inputs = sort_rows(inputs)
+    if initial_state is not None:
+      initial_state = nest.map_structure(sort_rows, initial_state)
+
+    offsets = [padded_size * k // num_buckets for k in range(num_buckets + 1)]
+    outputs = []
+    states = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+      # Rows are sorted, so the first row of a bucket is its longest.  Run
+      # at least one step, a bucket of padding rows has nothing to run.
+      bucket_time = math_ops.maximum(sorted_lengths[start], 1)
+      bucket_state = None
+      if initial_state is not None:
+        bucket_state = nest.map_structure(lambda s: s[start:end],
+                                          initial_state)
+      bucket_outputs, state = rnn.dynamic_rnn(
+          cell, sorted_inputs[start:end, :bucket_time],
+          sequence_length=sorted_lengths[start:end],
+          initial_state=bucket_state, dtype=dtype, scope=varscope)
+      # Pad by what the bucket actually ran, bucket_time is 1 even when
+      # max_time is 0.
+      outputs.append(array_ops.pad(
+          bucket_outputs,
+          [[0, 0], [0, max_time - array_ops.shape(bucket_outputs)[1]],
+           [0, 0]]))
+      states.append(state)
+
+    inverse = array_ops.invert_permutation(order)[:batch_size]
+    outputs = array_ops.gather(array_ops.concat(outputs, 0), inverse)
+    state = nest.map_structure(
+        lambda *s: array_ops.gather(array_ops.concat(s, 0), inverse), *states)
+  return outputs, state
+
+
+def make_step_fn(cell, input_size, session, dtype=dtypes.float32, scope=None):
+  """Builds one step of `cell` once and returns a fast Python callable for it.
+
+  Calling a cell from a Python loop adds its ops to the graph again on every
+  step.  Instead, the step is built a single time on placeholders and run
+  through `Session.make_callable`, which skips the feed and fetch
+  bookkeeping of `Session.run` on every call.  Variables are created (or
+  reused, if `cell` is already built) under `scope`; initializing or
+  restoring them is left to the caller.
+
+  Args:
+    cell: An instance of RNNCell.
+    input_size: Python int, the size of the inputs.
+    session: The `Session` the step is run in.
+    dtype: The data type of the inputs and the state.
+    scope: VariableScope for the created subgraph; defaults to "rnn".
+
+  Returns:
+    A function `step(inputs, state)` taking a `[batch_size, input_size]`
+    array and a state structured like `cell.state_size`, and returning the
+    `(output, new_state)` arrays.
+  """
+  inputs = array_ops.placeholder(dtype, [None, input_size])
+  state = nest.map_structure(
+      lambda s: array_ops.placeholder(
+          dtype, tensor_shape.TensorShape([None]).concatenate(s)),
+      cell.state_size)
+  with vs.variable_scope(scope or "rnn"):
+    output, new_state = cell(inputs, state)
+  run = session.make_callable([output, nest.flatten(new_state)],
+                              [inputs] + nest.flatten(state))
+
+  def step(step_inputs, step_state):
+    step_output, flat_state = run(step_inputs, *nest.flatten(step_state))
+    return step_output, nest.pack_sequence_as(cell.state_size, flat_state)
+  return step
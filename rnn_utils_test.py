@@ -0,0 +1,76 @@
+"""Tests for the drivers in `rnn_utils`."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.util import nest
+
+import h_cell
+import ln_cell
+import rnn_utils
+
+
+class PackedDynamicRnnTest(tf.test.TestCase):
+
+  def _check_matches_dynamic_rnn(self, lengths, num_buckets):
+    batch_size, input_size, num_units = len(lengths), 3, 4
+    max_time = max(lengths)
+    x = np.random.randn(batch_size, max_time, input_size).astype(np.float32)
+    with tf.Graph().as_default() as graph, self.test_session(
+        graph=graph) as sess:
+      inputs = tf.constant(x)
+      seq_lengths = tf.constant(lengths, dtype=tf.int32)
+      cell = ln_cell.LSTMCell(num_units)
+      packed_outputs, packed_state = rnn_utils.packed_dynamic_rnn(
+          cell, inputs, seq_lengths, num_buckets=num_buckets,
+          dtype=tf.float32)
+      # Same cell, so the same variables.
+      outputs, state = tf.nn.dynamic_rnn(
+          cell, inputs, sequence_length=seq_lengths, dtype=tf.float32)
+      sess.run(tf.global_variables_initializer())
+      results = sess.run([packed_outputs, packed_state, outputs, state])
+      self.assertAllClose(results[0], results[2], atol=1e-5)
+      self.assertAllClose(results[1], results[3], atol=1e-5)
+
+  def testSkewedLengths(self):
+    self._check_matches_dynamic_rnn([9, 1, 4, 2, 9, 0, 3, 1], num_buckets=3)
+
+  def testBatchSmallerThanNumBuckets(self):
+    self._check_matches_dynamic_rnn([5, 2], num_buckets=4)
+
+
+class MakeStepFnTest(tf.test.TestCase):
+
+  def _check_matches_cell(self, cell, input_size):
+    batch_size = 2
+    x = np.random.randn(batch_size, input_size).astype(np.float32)
+    state = nest.map_structure(
+        lambda s: np.random.randn(batch_size, s).astype(np.float32),
+        cell.state_size)
+    with tf.Graph().as_default() as graph, self.test_session(
+        graph=graph) as sess:
+      step = rnn_utils.make_step_fn(cell, input_size, sess)
+      # The cell is built by now, calling it again reuses its variables.
+      output, new_state = cell(tf.constant(x),
+                               nest.map_structure(tf.constant, state))
+      sess.run(tf.global_variables_initializer())
+      expected_output, expected_state = sess.run([output, new_state])
+      step_output, step_state = step(x, state)
+      self.assertAllClose(expected_output, step_output, atol=1e-5)
+      nest.assert_same_structure(cell.state_size, step_state)
+      self.assertAllClose(nest.flatten(expected_state),
+                          nest.flatten(step_state), atol=1e-5)
+
+  def testLSTMCell(self):
+    self._check_matches_cell(ln_cell.LSTMCell(4), input_size=3)
+
+  def testNestedHLSTMCellState(self):
+    self._check_matches_cell(
+        h_cell.H_LSTMCell(8, use_peepholes=True, hyper_num_units=8),
+        input_size=3)
+
+
+if __name__ == "__main__":
+  tf.test.main()